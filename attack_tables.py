@@ -1,4 +1,11 @@
-import flood_fill as ff
+import mmap
+import os
+import struct
+import zlib
+from array import array
+
+from gmpy2 import popcount
+
 from consts import (_64BITS, KNIGHT, BISHOP, ROOK, QUEEN, KING,
                     WHITE, BLACK)
 
@@ -135,28 +142,238 @@ bishop_masks = [0x40201008040200,
                 0x40201008040200]
 
 
-# Initialise table for rook attacks, indexed by square
-ratk_table = [{} for _ in range(64)]
-for sq in range(64):
-    occ = 0
-    # Produce attacks with occupancies of all subsets of rook mask
-    while True:
-        ratk_table[sq][occ] = ff.rook_attacks(sq, occ)
-        occ = (occ - rook_masks[sq]) & rook_masks[sq]  # Carry-Rippler
-        if not occ:
-            break
+# Magic numbers mapping each subset of a blocker mask to a distinct index, found by a random search
+# The index is the top bits of the product of the masked occupancy and the magic number,
+# with one bit for each square of the mask
+rook_magics = [0x128012c0008000e0,
+               0x240002000401001,
+               0x4100200041001008,
+               0x8280100008018004,
+               0x2080080002040080,
+               0x1300010004008208,
+               0x4000208a9101408,
+               0x20000204a018f04,
+               0x1080800040008020,
+               0xc01000402001,
+               0x80808010002000,
+               0x408800800801000,
+               0x10800801040080,
+               0x4804800400804200,
+               0x304800d00800200,
+               0x10200040081006a,
+               0x8280044020084000,
+               0x42000c010004021,
+               0x2010002004080020,
+               0x40210010000900,
+               0x8004004020041,
+               0x4008080040200,
+               0x1c20040070610208,
+               0x1020a20000508104,
+               0x100c00380008120,
+               0x4001200280400080,
+               0x200100080200080,
+               0x401200082200,
+               0xc02c080080040080,
+               0x840040080020080,
+               0x2102004040800100,
+               0x42079a00004104,
+               0x400424800280,
+               0x4820100020400040,
+               0x5010002000801880,
+               0x9061080081801002,
+               0x208a050011000800,
+               0x200080e003094,
+               0xa010018204003008,
+               0x2000288042001401,
+               0x400181c000228000,
+               0x200402010004000,
+               0x8388928600420021,
+               0x400021001001000a,
+               0x2100080011010004,
+               0x1002020004008080,
+               0x802000804020001,
+               0x88004410408a0001,
+               0x10508c030800100,
+               0x4000400080310100,
+               0x30200010048080,
+               0x2000800800100080,
+               0x100040008008080,
+               0x22000204008080,
+               0x108020170284400,
+               0x1001010084004200,
+               0x4890141902202,
+               0x100881100220042,
+               0x100102001000841,
+               0x4408050020081001,
+               0x2008884201002,
+               0x2002000490410802,
+               0x20014800900204,
+               0x100082081044402]
 
+bishop_magics = [0x4140421084010140,
+                 0x20821081011004,
+                 0x22900501d1128046,
+                 0x1208084100200406,
+                 0x4011041800a0000,
+                 0x32080208180000,
+                 0x1020090080a0420,
+                 0x4000154804042040,
+                 0x420400244440091,
+                 0x204101002004051,
+                 0x2b000800a1020044,
+                 0x880861040400,
+                 0x11041606002,
+                 0x82082838080442,
+                 0x40140088041020,
+                 0x10020602014498,
+                 0x1426441084080820,
+                 0x10002001220080,
+                 0x1402004044004080,
+                 0x8080c802084000,
+                 0xc2000402a20280,
+                 0x2006402608200422,
+                 0x40040404a6011002,
+                 0xc082210884980804,
+                 0x420200404091208,
+                 0x1010284e24080080,
+                 0x8804100002082142,
+                 0x1004010020200880,
+                 0x100108d004008,
+                 0x8000920005012081,
+                 0x4010521144c1000,
+                 0xa016052040809800,
+                 0x4300400410494,
+                 0x40108002022c0,
+                 0x8101024121080800,
+                 0x400b020080480080,
+                 0x40004100081100,
+                 0x8201010200040a00,
+                 0x4004808200140100,
+                 0x801020082002420,
+                 0x211100804202000,
+                 0x40004208c4006000,
+                 0x2001048020420,
+                 0x10802011021808,
+                 0x800020202008410,
+                 0x411010300c409020,
+                 0x82008010050c108,
+                 0x60208a122000301,
+                 0x4202080208041000,
+                 0x4800290808041000,
+                 0xa800004208040422,
+                 0x200020880040,
+                 0xe090001202020a00,
+                 0x10602101080c,
+                 0x4808b04448044000,
+                 0x901220c1020880,
+                 0x4011018804210c80,
+                 0x1c01040201050a,
+                 0x180800004044106c,
+                 0x202e001001048800,
+                 0x48080071020220,
+                 0x800608590041840,
+                 0x89004008400,
+                 0xa004300a00640080]
 
-# Initialise table for bishop attacks, indexed by square
-batk_table = [{} for _ in range(64)]
-for sq in range(64):
-    occ = 0
-    # Produce attacks with occupancies of all subsets of bishop mask
-    while True:
-        batk_table[sq][occ] = ff.bishop_attacks(sq, occ)
-        occ = (occ - bishop_masks[sq]) & bishop_masks[sq]  # Carry-Rippler
-        if not occ:
-            break
+rook_shifts = [64 - popcount(mask) for mask in rook_masks]
+bishop_shifts = [64 - popcount(mask) for mask in bishop_masks]
+
+
+# Gets the offset of each square in a flat table, followed by the size of the table
+def init_offsets(shifts):
+    offsets = [0]
+    for sq in range(64):
+        offsets.append(offsets[sq] + (1 << (64 - shifts[sq])))
+    return offsets
+
+
+rook_offsets = init_offsets(rook_shifts)
+bishop_offsets = init_offsets(bishop_shifts)
+
+
+# The flat tables are saved to a binary cache file, so they are only generated once
+# The file starts with a header holding a format version and a checksum of the masks and magic numbers,
+# followed by the rook and bishop tables in native byte order. The checksum is also taken in native
+# byte order, so a file written on a machine with a different byte order is treated as stale
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attack_tables.bin')
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sIQ')
+
+
+def get_cache_header():
+    checksum = zlib.crc32(array('Q', rook_masks + rook_magics + bishop_masks + bishop_magics).tobytes())
+    return CACHE_HEADER.pack(b'ATKT', CACHE_VERSION, checksum)
+
+
+# Loads the flat tables from the cache file with mmap, or generates them and rebuilds the cache file
+# if it is missing or stale. Loaded tables are read-only memoryviews, which index like arrays
+def load_magic_tables():
+    header = get_cache_header()
+    cache_size = len(header) + 8 * (rook_offsets[64] + bishop_offsets[64])
+
+    try:
+        with open(CACHE_PATH, 'rb') as cache_file:
+            data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # Missing or empty file
+        pass
+    else:
+        if len(data) == cache_size and data[:len(header)] == header:
+            tables = memoryview(data)[len(header):].cast('Q')
+            return tables[:rook_offsets[64]], tables[rook_offsets[64]:]
+        data.close()
+
+    # Generating the tables needs NumPy, so it is only imported when there is no valid cache
+    import flood_fill as ff
+    rook_table = ff.gen_magic_table(rook_masks, rook_magics, rook_shifts, rook_offsets, ff.rook_attacks_array)
+    bishop_table = ff.gen_magic_table(bishop_masks, bishop_magics, bishop_shifts, bishop_offsets,
+                                      ff.bishop_attacks_array)
+
+    # Write to a temporary file first, so other processes never load a partly written cache
+    temp_path = '{}.{}.tmp'.format(CACHE_PATH, os.getpid())
+    try:
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(header)
+            rook_table.tofile(cache_file)
+            bishop_table.tofile(cache_file)
+        os.replace(temp_path, CACHE_PATH)
+    except OSError:  # The tables are still usable if the cache cannot be written
+        pass
+
+    return rook_table, bishop_table
+
+
+rook_table, bishop_table = load_magic_tables()
+
+
+# Initialise dicts of slider attacks keyed by the masked occupancy, indexed by square
+# In Python, probing a dict is faster than computing the magic index, so these are used for single lookups
+def init_attack_dicts(masks, magics, shifts, table, offsets):
+    attack_dicts = [{} for _ in range(64)]
+    for sq in range(64):
+        occ = 0
+        while True:
+            attack_dicts[sq][occ] = table[offsets[sq] + (((occ * magics[sq]) & _64BITS) >> shifts[sq])]
+            occ = (occ - masks[sq]) & masks[sq]  # Carry-Rippler
+            if not occ:
+                break
+
+    return attack_dicts
+
+
+ratk_table = init_attack_dicts(rook_masks, rook_magics, rook_shifts, rook_table, rook_offsets)
+batk_table = init_attack_dicts(bishop_masks, bishop_magics, bishop_shifts, bishop_table, bishop_offsets)
+
+
+def rook_attacks(sq, occ):
+    return ratk_table[sq][occ & rook_masks[sq]]
+
+
+def bishop_attacks(sq, occ):
+    return batk_table[sq][occ & bishop_masks[sq]]
+
+
+def queen_attacks(sq, occ):
+    return batk_table[sq][occ & bishop_masks[sq]] | ratk_table[sq][occ & rook_masks[sq]]
 
 
 # Initialise table for non-pawn attacks, indexed by piece type and square
@@ -0,0 +1,426 @@
+import numpy as np
+
+from common import forward_ranks
+from consts import (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, COLOURS, PIECES, PIECE_TYPES,
+                    MATERIAL, MIDGAME, ENDGAME, PHASE_WEIGHT, KINGSIDE, QUEENSIDE, ISOLATED, DOUBLED, BACKWARD,
+                    A_FILE_BB, H_FILE_BB, RANK_1_BB, RANK_2_BB, RANK_7_BB, RANK_8_BB, _64BITS)
+from eval_tables import (psq_table, mobility, connected_bonus, player_imbalance, enemy_imbalance,
+                         shelter_strength, unblocked_storm)
+from attack_tables import (rook_table, rook_masks, rook_magics, rook_shifts, rook_offsets,
+                           bishop_table, bishop_masks, bishop_magics, bishop_shifts, bishop_offsets)
+from position_state import PACKED_SIZE
+
+# Evaluates many positions at once with NumPy, giving the same scores as Evaluate.evaluate
+# Bitboards are held in uint64 arrays with one element per position, and each evaluation term
+# is computed for all of the positions with set-wise bitboard operations and table lookups
+
+# Record layout of the binary encoding of a position, see position_state.PACKED_STRUCT
+PACKED_DTYPE = np.dtype([('occupancy', '<u8'), ('pieces', 'u1', 16), ('flags', 'u1'), ('ep_square', 'u1'),
+                         ('halfmove_clock', 'u1'), ('fullmove_number', '<u2'), ('padding', 'u1', 3)])
+
+NOT_A_FILE = _64BITS ^ A_FILE_BB
+NOT_H_FILE = _64BITS ^ H_FILE_BB
+
+# Piece-square scores, indexed by piece, then square, then phase
+psq_array = np.zeros((15, 64, 2), dtype=np.int64)
+for piece in PIECES:
+    psq_array[piece] = psq_table[piece]
+
+# Mobility scores, indexed by piece type, then number of moves, then phase
+mobility_arrays = [None if table is None else np.array(table, dtype=np.int64) for table in mobility]
+
+# Connected pawn scores, indexed by opposed, aligned, defenders and relative rank, then phase
+# Pawns are never on the first or last rank, which have no score
+connected_array = np.array([[[[rank_bonus if rank_bonus[0] is not None else (0, 0)
+                               for rank_bonus in defenders_bonus]
+                              for defenders_bonus in aligned_bonus]
+                             for aligned_bonus in opposed_bonus]
+                            for opposed_bonus in connected_bonus], dtype=np.int64).reshape(-1, 2)
+
+shelter_array = np.array(shelter_strength, dtype=np.int64)
+storm_array = np.array(unblocked_storm, dtype=np.int64)
+forward_ranks_array = np.array(forward_ranks, dtype=np.uint64)
+
+# Flat slider attack tables and magic numbers, shared with attack_tables
+rook_table_array = np.frombuffer(rook_table, dtype=np.uint64)
+rook_masks_array = np.array(rook_masks, dtype=np.uint64)
+rook_magics_array = np.array(rook_magics, dtype=np.uint64)
+rook_shifts_array = np.array(rook_shifts, dtype=np.uint64)
+rook_offsets_array = np.array(rook_offsets[:64], dtype=np.int64)
+bishop_table_array = np.frombuffer(bishop_table, dtype=np.uint64)
+bishop_masks_array = np.array(bishop_masks, dtype=np.uint64)
+bishop_magics_array = np.array(bishop_magics, dtype=np.uint64)
+bishop_shifts_array = np.array(bishop_shifts, dtype=np.uint64)
+bishop_offsets_array = np.array(bishop_offsets[:64], dtype=np.int64)
+
+# Rank and file of each square, and the Chebyshev distance between two squares
+sq_rank = np.arange(64) >> 3
+sq_file = np.arange(64) & 7
+sq_distance = np.maximum(abs(sq_rank[:, None] - sq_rank[None, :]), abs(sq_file[:, None] - sq_file[None, :]))
+
+# Index of the lowest and highest set bit of each byte
+lsb_of_byte = np.array([(byte & -byte).bit_length() - 1 for byte in range(256)], dtype=np.int64)
+msb_of_byte = np.array([byte.bit_length() - 1 for byte in range(256)], dtype=np.int64)
+
+
+# Converts an array of bitboards to an array of 64 booleans for each bitboard, in square order
+def to_squares(bb):
+    return np.unpackbits(bb.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little').view(bool)
+
+
+# Bits are counted per byte before NumPy 2.0, which has no bitwise_count
+popcount_of_byte = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int64)
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(bb):
+        return np.bitwise_count(bb).astype(np.int64)
+else:
+    def popcount(bb):
+        bb = np.ascontiguousarray(bb, dtype='<u8')
+        return popcount_of_byte[bb.view(np.uint8).reshape(bb.shape + (8,))].sum(axis=-1)
+
+
+# Gets the lowest set bit of each bitboard
+def lsb(bb):
+    return bb & (~bb + np.uint64(1))
+
+
+# Gets the square of a single set bit in each bitboard
+def bit_index(bb):
+    return np.frexp(bb.astype(np.float64))[1].astype(np.int64) - 1
+
+
+# Fills each bitboard towards the north or south, not including the starting squares
+def north_fill(bb):
+    bb = bb | (bb << np.uint64(8))
+    bb = bb | (bb << np.uint64(16))
+    bb = bb | (bb << np.uint64(32))
+    return bb << np.uint64(8)
+
+
+def south_fill(bb):
+    bb = bb | (bb >> np.uint64(8))
+    bb = bb | (bb >> np.uint64(16))
+    bb = bb | (bb >> np.uint64(32))
+    return bb >> np.uint64(8)
+
+
+# Squares on the files either side of each square
+def lateral(bb):
+    return ((bb & np.uint64(NOT_H_FILE)) << np.uint64(1)) | ((bb & np.uint64(NOT_A_FILE)) >> np.uint64(1))
+
+
+# Slider attacks of a single piece on the given square in each position, from the flat magic tables
+def magic_attacks(sq, occ, table, masks, magics, shifts, offsets):
+    return table[offsets[sq] + ((occ & masks[sq]) * magics[sq] >> shifts[sq]).astype(np.int64)]
+
+
+def bishop_attacks(sq, occ):
+    return magic_attacks(sq, occ, bishop_table_array, bishop_masks_array, bishop_magics_array,
+                         bishop_shifts_array, bishop_offsets_array)
+
+
+def rook_attacks(sq, occ):
+    return magic_attacks(sq, occ, rook_table_array, rook_masks_array, rook_magics_array,
+                         rook_shifts_array, rook_offsets_array)
+
+
+def knight_attacks(knights):
+    not_ab = np.uint64(NOT_A_FILE & (NOT_A_FILE << 1) & _64BITS)
+    not_gh = np.uint64(NOT_H_FILE & (NOT_H_FILE >> 1))
+    not_a = np.uint64(NOT_A_FILE)
+    not_h = np.uint64(NOT_H_FILE)
+    return (((knights << np.uint64(17)) & not_a) | ((knights << np.uint64(15)) & not_h)
+            | ((knights << np.uint64(10)) & not_ab) | ((knights << np.uint64(6)) & not_gh)
+            | ((knights >> np.uint64(17)) & not_h) | ((knights >> np.uint64(15)) & not_a)
+            | ((knights >> np.uint64(10)) & not_gh) | ((knights >> np.uint64(6)) & not_ab))
+
+
+# Batch of positions, held as arrays with one element per position
+class PositionBatch:
+    def __init__(self, piece_bb, colour, castling_rights):
+        # piece_bb: uint64 array of shape (15, N), indexed by piece
+        self.piece_bb = piece_bb
+        self.colour = colour
+        self.castling_rights = castling_rights
+
+        self.player_occ = [np.bitwise_or.reduce(piece_bb[(player << 3) | PAWN:((player << 3) | KING) + 1])
+                           for player in COLOURS]
+        self.occupancy = self.player_occ[WHITE] | self.player_occ[BLACK]
+        self.piece_count = popcount(piece_bb)
+
+    def __len__(self):
+        return len(self.colour)
+
+    # Creates a batch from a buffer of positions in the binary encoding of position_state
+    @classmethod
+    def from_packed(cls, buffer):
+        records = np.frombuffer(buffer, dtype=PACKED_DTYPE, count=len(buffer) // PACKED_SIZE)
+        occupied = to_squares(records['occupancy'])
+
+        # The pieces are stored 4 bits each, in the order of the occupied squares
+        pieces = np.empty((len(records), 32), dtype=np.uint8)
+        pieces[:, 0::2] = records['pieces'] & 0xF
+        pieces[:, 1::2] = records['pieces'] >> 4
+        order = np.maximum(np.cumsum(occupied, axis=1) - 1, 0)
+        squares = np.where(occupied, np.take_along_axis(pieces, order, axis=1), 0)
+
+        piece_bb = np.zeros((15, len(records)), dtype=np.uint64)
+        for piece in PIECES:
+            piece_bb[piece] = np.packbits(squares == piece, axis=1, bitorder='little').view('<u8').ravel()
+
+        return cls(piece_bb, (records['flags'] & 1).astype(np.int64), (records['flags'] >> 1).astype(np.int64))
+
+    # Creates a batch from PositionState objects
+    @classmethod
+    def from_states(cls, states):
+        piece_bb = np.zeros((15, len(states)), dtype=np.uint64)
+        fields = np.array([state[:14] for state in states], dtype=np.uint64).reshape(-1, 14)
+        for index, piece in enumerate(PIECES):
+            piece_bb[piece] = fields[:, index]
+
+        return cls(piece_bb, fields[:, 12].astype(np.int64), fields[:, 13].astype(np.int64))
+
+
+def imbalance(batch, colour):
+    count = batch.piece_count
+    imbalance_score = np.zeros(len(batch), dtype=np.int64)
+
+    player_bishop_pair = count[(colour << 3) | BISHOP] > 1
+    enemy_bishop_pair = count[((colour ^ 1) << 3) | BISHOP] > 1
+    imbalance_score += player_bishop_pair * (player_imbalance[0][0] * player_bishop_pair
+                                             + enemy_imbalance[0][0] * enemy_bishop_pair)
+
+    for piece_type_one in PIECE_TYPES[:QUEEN]:
+        temp = np.zeros(len(batch), dtype=np.int64)
+        for piece_type_two in PIECE_TYPES[:piece_type_one]:
+            temp += (player_imbalance[piece_type_one][piece_type_two] * count[(colour << 3) | piece_type_two]
+                     + enemy_imbalance[piece_type_one][piece_type_two] * count[((colour ^ 1) << 3) | piece_type_two])
+        imbalance_score += count[(colour << 3) | piece_type_one] * temp
+
+    return imbalance_score
+
+
+def evaluate_material(batch):
+    imbalance_score = (imbalance(batch, WHITE) - imbalance(batch, BLACK)) // 16
+    score_mg = imbalance_score.copy()
+    score_eg = imbalance_score.copy()
+
+    for piece_type in PIECE_TYPES:
+        count = batch.piece_count[(WHITE << 3) | piece_type] - batch.piece_count[(BLACK << 3) | piece_type]
+        score_mg += MATERIAL[piece_type][MIDGAME] * count
+        score_eg += MATERIAL[piece_type][ENDGAME] * count
+
+    return score_mg, score_eg
+
+
+def evaluate_psq(batch):
+    score = np.zeros((len(batch), 2), dtype=np.int64)
+    for piece in PIECES:
+        sign = 1 if piece >> 3 == WHITE else -1
+        score += sign * (to_squares(batch.piece_bb[piece]).astype(np.int64) @ psq_array[piece])
+
+    return score[:, MIDGAME], score[:, ENDGAME]
+
+
+def evaluate_pawns(batch):
+    score_mg = np.zeros(len(batch), dtype=np.int64)
+    score_eg = np.zeros(len(batch), dtype=np.int64)
+
+    for colour in COLOURS:
+        sign = 1 if colour == WHITE else -1
+        player_pawns = batch.piece_bb[(colour << 3) | PAWN]
+        enemy_pawns = batch.piece_bb[((colour ^ 1) << 3) | PAWN]
+        not_a = np.uint64(NOT_A_FILE)
+        not_h = np.uint64(NOT_H_FILE)
+
+        # Pawn attacks are shifted without removing squares wrapping around the board, as in Evaluate
+        if colour == WHITE:
+            enemy_pawn_attacks = (enemy_pawns >> np.uint64(9)) | (enemy_pawns >> np.uint64(7))
+            defended_west = player_pawns & ((player_pawns & not_h) << np.uint64(9))
+            defended_east = player_pawns & ((player_pawns & not_a) << np.uint64(7))
+            opposed = player_pawns & south_fill(enemy_pawns)
+            doubled = player_pawns & (player_pawns << np.uint64(8))
+            blocked = player_pawns & ((enemy_pawns | enemy_pawn_attacks) >> np.uint64(8))
+            supported = north_fill(lateral(player_pawns))
+        else:
+            enemy_pawn_attacks = (enemy_pawns << np.uint64(9)) | (enemy_pawns << np.uint64(7))
+            defended_west = player_pawns & ((player_pawns & not_a) >> np.uint64(9))
+            defended_east = player_pawns & ((player_pawns & not_h) >> np.uint64(7))
+            opposed = player_pawns & north_fill(enemy_pawns)
+            doubled = player_pawns & (player_pawns >> np.uint64(8))
+            blocked = player_pawns & ((enemy_pawns | enemy_pawn_attacks) << np.uint64(8))
+            supported = south_fill(lateral(player_pawns))
+
+        aligned = player_pawns & lateral(player_pawns)
+        defended = defended_west | defended_east
+        connected = aligned | defended
+        files = player_pawns | north_fill(player_pawns) | south_fill(player_pawns)
+        isolated = player_pawns & ~lateral(files) & ~connected
+        backward = player_pawns & lateral(files) & ~connected & blocked & ~supported
+
+        # Doubled pawns
+        doubled_count = popcount(doubled & ~defended)
+        score_mg -= sign * DOUBLED[MIDGAME] * doubled_count
+        score_eg -= sign * DOUBLED[ENDGAME] * doubled_count
+
+        # Connected pawns, scored for each square
+        index = (((to_squares(opposed).astype(np.int64) * 2 + to_squares(aligned)) * 3
+                  + to_squares(defended_west) + to_squares(defended_east)) * 8 + (sq_rank ^ (colour * 7)))
+        bonus = np.where(to_squares(connected)[:, :, None], connected_array[index], 0).sum(axis=1)
+        score_mg += sign * bonus[:, MIDGAME]
+        score_eg += sign * bonus[:, ENDGAME]
+
+        # Isolated and backward pawns
+        isolated_count = popcount(isolated)
+        backward_count = popcount(backward)
+        score_mg -= sign * (ISOLATED[MIDGAME] * isolated_count + BACKWARD[MIDGAME] * backward_count)
+        score_eg -= sign * (ISOLATED[ENDGAME] * isolated_count + BACKWARD[ENDGAME] * backward_count)
+
+    return score_mg, score_eg
+
+
+def get_mobility_area(batch, colour):
+    player_pawns = batch.piece_bb[(colour << 3) | PAWN]
+    enemy_pawns = batch.piece_bb[((colour ^ 1) << 3) | PAWN]
+
+    if colour == WHITE:
+        enemy_pawn_attacks = (enemy_pawns >> np.uint64(9)) | (enemy_pawns >> np.uint64(7))
+        blocked = player_pawns & ((enemy_pawns >> np.uint64(8)) | np.uint64((RANK_1_BB << 1) | (RANK_1_BB << 2)))
+    else:
+        enemy_pawn_attacks = (enemy_pawns << np.uint64(9)) | (enemy_pawns << np.uint64(7))
+        blocked = player_pawns & ((enemy_pawns << np.uint64(8)) | np.uint64((RANK_1_BB << 6) | (RANK_1_BB << 5)))
+
+    return ~(enemy_pawn_attacks | blocked | batch.piece_bb[(colour << 3) | KING]
+             | batch.piece_bb[(colour << 3) | QUEEN])
+
+
+def evaluate_mobility(batch):
+    score = np.zeros((len(batch), 2), dtype=np.int64)
+
+    for colour in COLOURS:
+        sign = 1 if colour == WHITE else -1
+        mobility_area = get_mobility_area(batch, colour)
+        queens = batch.piece_bb[(colour << 3) | QUEEN]
+        rooks_queens = batch.piece_bb[(colour << 3) | ROOK] | queens
+
+        # Pieces are taken one at a time from every position in the batch
+        for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN):
+            pieces = batch.piece_bb[(colour << 3) | piece_type].copy()
+            while pieces.any():
+                piece_bb = lsb(pieces)
+                if piece_type == KNIGHT:
+                    moves = knight_attacks(piece_bb)
+                else:
+                    sq = bit_index(piece_bb)
+                    if piece_type == BISHOP:
+                        moves = bishop_attacks(sq, batch.occupancy ^ queens)
+                    elif piece_type == ROOK:
+                        moves = rook_attacks(sq, batch.occupancy ^ rooks_queens)
+                    else:
+                        moves = bishop_attacks(sq, batch.occupancy) | rook_attacks(sq, batch.occupancy)
+
+                move_count = popcount(moves & mobility_area)
+                score += sign * np.where((piece_bb != 0)[:, None], mobility_arrays[piece_type][move_count], 0)
+                pieces ^= piece_bb
+
+    return score[:, MIDGAME], score[:, ENDGAME]
+
+
+# Gets the rank of each piece on a file, as a bitmask with one bit for each rank
+def file_ranks(bb, file_num):
+    bb = (bb >> file_num.astype(np.uint64)) & np.uint64(A_FILE_BB)
+    ranks = np.zeros(len(bb), dtype=np.int64)
+    for rank_num in range(8):
+        ranks |= ((bb >> np.uint64(rank_num * 8)) & np.uint64(1)).astype(np.int64) << rank_num
+    return ranks
+
+
+def evaluate_king_shelter(batch, colour, king_sqr):
+    shelter_ranks = RANK_1_BB | RANK_2_BB if colour == WHITE else RANK_7_BB | RANK_8_BB
+    ranks_in_front = ~forward_ranks_array[colour ^ 1][king_sqr]
+
+    player_pawns = batch.piece_bb[(colour << 3) | PAWN] & ranks_in_front
+    enemy_pawns = batch.piece_bb[((colour ^ 1) << 3) | PAWN] & ranks_in_front
+
+    # Give a bonus for enemy edge pawns in front of our king
+    if colour == WHITE:
+        edge_pawns = enemy_pawns >> np.uint64(8)
+    else:
+        edge_pawns = enemy_pawns << np.uint64(8)
+    edge_pawns &= np.uint64((A_FILE_BB | H_FILE_BB) & shelter_ranks)
+    safety_score = np.where(edge_pawns & (np.uint64(1) << king_sqr.astype(np.uint64)), 374, 5)
+
+    # Iterate through the centre file of the king shelter and the two adjacent files
+    centre = np.clip(king_sqr & 7, 1, 6)
+    for offset in (-1, 0, 1):
+        file_num = centre + offset
+
+        player_ranks = file_ranks(player_pawns, file_num)
+        enemy_ranks = file_ranks(enemy_pawns, file_num)
+        if colour == WHITE:
+            player_rank = np.where(player_ranks, lsb_of_byte[player_ranks], 0)
+            enemy_rank = np.where(enemy_ranks, msb_of_byte[enemy_ranks], 0)
+        else:
+            player_rank = np.where(player_ranks, msb_of_byte[player_ranks] ^ 7, 0)
+            enemy_rank = np.where(enemy_ranks, lsb_of_byte[enemy_ranks] ^ 7, 0)
+
+        min_file = np.minimum(file_num, file_num ^ 7)
+        safety_score += shelter_array[min_file, player_rank]
+        blocked = (player_rank != 0) & (player_rank == enemy_rank - 1)
+        safety_score -= np.where(blocked, np.where(enemy_rank == 2, 66, 0), storm_array[min_file, enemy_rank])
+
+    return safety_score
+
+
+def get_king_safety(batch, colour):
+    king_sqr = bit_index(batch.piece_bb[(colour << 3) | KING])
+
+    # Distance between the king and the closest pawn of its colour, or 0 if there are none
+    pawns = to_squares(batch.piece_bb[(colour << 3) | PAWN])
+    distance = np.where(pawns, sq_distance[king_sqr], 8).min(axis=1)
+    king_pawn_distance = np.where(distance == 8, 0, distance)
+
+    # Use the shelter of a castled king if castling is possible and the shelter is better
+    score = evaluate_king_shelter(batch, colour, king_sqr)
+    for castling_right, castled_sqr in ((KINGSIDE << colour, 6 ^ (colour * 56)),
+                                        (QUEENSIDE << colour, 2 ^ (colour * 56))):
+        can_castle = (batch.castling_rights & castling_right) != 0
+        if can_castle.any():
+            castled_score = evaluate_king_shelter(batch, colour, np.full(len(batch), castled_sqr))
+            score = np.where(can_castle, np.maximum(score, castled_score), score)
+
+    return score, -16 * king_pawn_distance
+
+
+# Evaluates every position of a batch, from the point of view of the side to move
+def evaluate_batch(batch):
+    score_mg = np.zeros(len(batch), dtype=np.int64)
+    score_eg = np.zeros(len(batch), dtype=np.int64)
+
+    for term in (evaluate_psq, evaluate_material, evaluate_pawns, evaluate_mobility):
+        term_mg, term_eg = term(batch)
+        score_mg += term_mg
+        score_eg += term_eg
+
+    w_king_score_mg, w_king_score_eg = get_king_safety(batch, WHITE)
+    b_king_score_mg, b_king_score_eg = get_king_safety(batch, BLACK)
+    score_mg += w_king_score_mg - b_king_score_mg
+    score_eg += w_king_score_eg - b_king_score_eg
+
+    # Interpolate between midgame and endgame score based on phase
+    game_phase = sum(PHASE_WEIGHT[piece & 7] * batch.piece_count[piece] for piece in PIECES)
+    phase = ((24 - game_phase) * 256 + 12) // 24
+    score = (score_mg * (256 - phase) + score_eg * phase) // 256
+
+    # Return score from current player's perspective + bonus for the side to move
+    return np.where(batch.colour == WHITE, score, -score) + 28
+
+
+# Evaluates a buffer of positions in the binary encoding of position_state
+def evaluate_packed(buffer):
+    return evaluate_batch(PositionBatch.from_packed(buffer))
+
+
+def evaluate_states(states):
+    return evaluate_batch(PositionBatch.from_states(states))
@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+
+from position import Position
+from search import Search
+from moves import move_to_uci
+
+
+# Positions searched by the benchmark, covering openings, middlegames with both sides castled or not,
+# tactical positions with promotions and en passant, and endgames
+BENCH_FENS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+    'r3k2r/2pb1ppp/2pp1q2/p7/1nP1B3/1P2P3/P2N1PPP/R2QK2R w KQkq a6 0 14',
+    '4rrk1/2p1b1p1/p1p3q1/4p3/2P2n1p/1P1NR2P/PB3PP1/3R1QK1 b - - 2 24',
+    'r3qbrk/6p1/2b2pPp/p3pP1Q/PpPpP2P/3P1B2/2PB3K/R5R1 w - - 16 42',
+    '4k3/3q1r2/1N2r1b1/3ppN2/2nPP3/1B1R2n1/2R1Q3/3K4 w - - 5 1',
+    'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    '6k1/6p1/6Pp/ppp5/3pn2P/1P3K2/1PP2P2/8 b - - 3 54',
+    '8/8/1P6/5pr1/8/4R3/7k/2K5 w - - 0 1',
+]
+
+
+# Searches each position to a fixed depth with a new search, so that results do not depend on earlier searches
+# The total node count is the signature of the benchmark, which changes whenever the search tree changes
+def run_bench(depth, fens=BENCH_FENS):
+    results = []
+    for fen in fens:
+        search = Search(Position(fen))
+        start_time = time.time()
+        move = search.iter_search(max_depth=depth, verbose=False)
+        elapsed = time.time() - start_time
+        results.append({'fen': fen, 'move': move_to_uci(move), 'nodes': search.node_count, 'time': elapsed})
+        print("{} {}: {} nodes, {:0.2f}s".format(fen, move_to_uci(move), search.node_count, elapsed))
+
+    total_nodes = sum(result['nodes'] for result in results)
+    total_time = sum(result['time'] for result in results)
+
+    return {
+        'depth': depth,
+        'positions': results,
+        'nodes': total_nodes,
+        'time': total_time,
+        'nps': round(total_nodes / total_time) if total_time else 0,
+        'signature': total_nodes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a fixed set of positions to a fixed depth")
+    parser.add_argument('depth', type=int, nargs='?', default=5, help="search depth (default: %(default)s)")
+    parser.add_argument('--json', metavar='PATH', help="also write the results to a JSON file")
+    args = parser.parse_args()
+
+    bench = run_bench(args.depth)
+
+    print()
+    print("Total time (s): {:0.2f}".format(bench['time']))
+    print("Nodes searched: {}".format(bench['nodes']))
+    print("Nodes per second: {}".format(bench['nps']))
+    print("Signature: {}".format(bench['signature']))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(bench, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
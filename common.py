@@ -1,13 +1,11 @@
 import operator
 import re
 
-import flood_fill as ff
-from gmpy2 import bit_scan1
 from consts import (W_PAWN, W_KNIGHT, W_BISHOP, W_ROOK, W_QUEEN, W_KING, B_PAWN, B_KNIGHT, B_BISHOP, B_ROOK,
                     B_QUEEN, B_KING, RANK_1_BB, RANK_2_BB, RANK_3_BB, RANK_4_BB, RANK_5_BB, RANK_6_BB,
                     RANK_7_BB, RANK_8_BB, A_FILE_BB, B_FILE_BB, C_FILE_BB, D_FILE_BB, E_FILE_BB, F_FILE_BB,
-                    G_FILE_BB, H_FILE_BB, WHITE, BLACK, NORTH, EAST, KING)
-from attack_tables import pseudo_attacks
+                    G_FILE_BB, H_FILE_BB, WHITE, BLACK, NORTH, EAST, BISHOP, ROOK, KING)
+from tables import TableRegistry
 
 # FEN string for starting chess position
 starting_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
@@ -17,9 +15,9 @@ rank = r'[rnbqkpRNBQKP1-8]{1,8}'
 board_fen = rank + '/' + rank + '/' + rank + '/' + rank + '/' + rank + '/' + rank + '/' + rank + '/' + rank
 regex_fen = re.compile(r'^' + board_fen + r' [wb] (?:(?:K?Q?k?q?)|-) (?:(?:[a-h][1-8])|-) \d+ \d+$')
 regex_square = re.compile(r'[a-h][1-8]')
-regex_san = re.compile(r'^(?:(?P<qCastle>O-O-O)|(?P<kCastle>O-O)|(?P<srcPiece>[NbRQK])?'
+regex_san = re.compile(r'^(?:(?P<qCastle>O-O-O)|(?P<kCastle>O-O)|(?P<srcPiece>[NBRQK])?'
                        r'(?P<srcHint>[a-h1-8]{1,2})?(?P<action>x)?(?P<dstSquare>[a-h][1-8])'
-                       r'(?P<promote>=[NbRQ])?)(?P<check>[+#])?')
+                       r'(?P<promote>=[NBRQ])?)(?P<check>[+#])?')
 
 # Used for converting files from letters to numbers
 notation_to_index = {"a": 1,
@@ -101,93 +99,90 @@ for row, rank in enumerate('87654321'):
     for col, file in enumerate('abcdefgh'):
         square_to_coords[file + rank] = (col, row)
 
+# Engine tables below are built the first time they are accessed, so that importing this module
+# for notation and FEN helpers does not pay for them
+registry = TableRegistry(__name__)
+
+
+def __getattr__(name):
+    return registry.build(name)
+
+
 # Used for getting the bitboard for the rank of a square
-rank_of = [None for _ in range(64)]
-for sq in range(64):
-    rank_num = sq >> 3
-    if rank_num == 0:
-        rank_of[sq] = RANK_1_BB
-    elif rank_num == 1:
-        rank_of[sq] = RANK_2_BB
-    elif rank_num == 2:
-        rank_of[sq] = RANK_3_BB
-    elif rank_num == 3:
-        rank_of[sq] = RANK_4_BB
-    elif rank_num == 4:
-        rank_of[sq] = RANK_5_BB
-    elif rank_num == 5:
-        rank_of[sq] = RANK_6_BB
-    elif rank_num == 6:
-        rank_of[sq] = RANK_7_BB
-    elif rank_num == 7:
-        rank_of[sq] = RANK_8_BB
+@registry.register('rank_of')
+def init_rank_of():
+    ranks = [RANK_1_BB, RANK_2_BB, RANK_3_BB, RANK_4_BB, RANK_5_BB, RANK_6_BB, RANK_7_BB, RANK_8_BB]
+    return [ranks[sq >> 3] for sq in range(64)]
+
 
 # Used for getting the bitboard for the file of a square
-file_of = [None for _ in range(64)]
-for sq in range(64):
-    file_num = sq & 7
-    if file_num == 0:
-        file_of[sq] = A_FILE_BB
-    elif file_num == 1:
-        file_of[sq] = B_FILE_BB
-    elif file_num == 2:
-        file_of[sq] = C_FILE_BB
-    elif file_num == 3:
-        file_of[sq] = D_FILE_BB
-    elif file_num == 4:
-        file_of[sq] = E_FILE_BB
-    elif file_num == 5:
-        file_of[sq] = F_FILE_BB
-    elif file_num == 6:
-        file_of[sq] = G_FILE_BB
-    elif file_num == 7:
-        file_of[sq] = H_FILE_BB
+@registry.register('file_of')
+def init_file_of():
+    files = [A_FILE_BB, B_FILE_BB, C_FILE_BB, D_FILE_BB, E_FILE_BB, F_FILE_BB, G_FILE_BB, H_FILE_BB]
+    return [files[sq & 7] for sq in range(64)]
+
 
 # Gets all the squares in front, indexed by square and colour
-forward_ranks = [[0 for _ in range(64)] for _ in range(2)]
-for s1 in range(64):
-    s1_rank = s1 >> 3
-    for s2 in range(64):
-        s2_rank = s2 >> 3
-        if s2_rank > s1_rank:
-            forward_ranks[WHITE][s1] |= 1 << s2
-        elif s2_rank < s1_rank:
-            forward_ranks[BLACK][s1] |= 1 << s2
-    
+@registry.register('forward_ranks')
+def init_forward_ranks():
+    forward_ranks = [[0 for _ in range(64)] for _ in range(2)]
+    for s1 in range(64):
+        s1_rank = s1 >> 3
+        for s2 in range(64):
+            s2_rank = s2 >> 3
+            if s2_rank > s1_rank:
+                forward_ranks[WHITE][s1] |= 1 << s2
+            elif s2_rank < s1_rank:
+                forward_ranks[BLACK][s1] |= 1 << s2
+    return forward_ranks
+
+
 # Gets the bitboards for the files adjacent to the square used as index
-adjacent_files = [None for _ in range(64)]
-for sq in range(64):
-    adjacent_files[sq] = 0
-    if not (1 << sq) & A_FILE_BB:
-        adjacent_files[sq] |= file_of[sq - 1]
-    if not (1 << sq) & H_FILE_BB:
-        adjacent_files[sq] |= file_of[sq + 1]
-
-# Gets the bitboard for the squares between the two squares used as indices
-bb_between = [[None for _ in range(64)] for _ in range(64)]
-for sqr1 in range(64):
-    for sqr2 in range(64):
-        rook_n = ff.ratks_n(sqr1, 0) & ff.ratks_s(sqr2, 0)
-        rook_s = ff.ratks_s(sqr1, 0) & ff.ratks_n(sqr2, 0)
-        rook_e = ff.ratks_e(sqr1, 0) & ff.ratks_w(sqr2, 0)
-        rook_w = ff.ratks_w(sqr1, 0) & ff.ratks_e(sqr2, 0)
-        bishop_ne = ff.batks_ne(sqr1, 0) & ff.batks_sw(sqr2, 0)
-        bishop_sw = ff.batks_sw(sqr1, 0) & ff.batks_ne(sqr2, 0)
-        bishop_se = ff.batks_se(sqr1, 0) & ff.batks_nw(sqr2, 0)
-        bishop_nw = ff.batks_nw(sqr1, 0) & ff.batks_se(sqr2, 0)
-        bb_between[sqr1][sqr2] = rook_e | rook_w | rook_n | rook_s | bishop_ne | bishop_sw | bishop_se | bishop_nw
+@registry.register('adjacent_files')
+def init_adjacent_files():
+    file_of = init_file_of()
+    adjacent_files = [0 for _ in range(64)]
+    for sq in range(64):
+        if not (1 << sq) & A_FILE_BB:
+            adjacent_files[sq] |= file_of[sq - 1]
+        if not (1 << sq) & H_FILE_BB:
+            adjacent_files[sq] |= file_of[sq + 1]
+    return adjacent_files
+
+
+# Gets the bitboard for the squares between the two squares used as indices (empty if not aligned),
+# and the bitboard for the whole line through the two squares (empty if not aligned)
+@registry.register('bb_between', 'bb_line')
+def init_lines():
+    from attack_tables import pseudo_attacks, bishop_attacks, rook_attacks
+
+    bb_between = [[0 for _ in range(64)] for _ in range(64)]
+    bb_line = [[0 for _ in range(64)] for _ in range(64)]
+    for sqr1 in range(64):
+        for sqr2 in range(64):
+            for slider, slider_attacks in ((BISHOP, bishop_attacks), (ROOK, rook_attacks)):
+                if pseudo_attacks[slider][sqr1] & (1 << sqr2):
+                    bb_between[sqr1][sqr2] = slider_attacks(sqr1, 1 << sqr2) & slider_attacks(sqr2, 1 << sqr1)
+                    bb_line[sqr1][sqr2] = ((pseudo_attacks[slider][sqr1] & pseudo_attacks[slider][sqr2])
+                                           | (1 << sqr1) | (1 << sqr2))
+    return bb_between, bb_line
+
 
 # Gets the bitboard of squares with a given distance from another square
-distance_ring = [[0 for _ in range(8)] for _ in range(64)]
-for s1 in range(64):
-    s1_rank = s1 >> 3
-    s1_file = s1 & 7
-    for s2 in range(64):
-        if s1 != s2:
-            s2_rank = s2 >> 3
-            s2_file = s2 & 7
-            distance = max(abs(s2_rank - s1_rank), abs(s2_file - s1_file))
-            distance_ring[s1][distance] |= (1 << s2)
+@registry.register('distance_ring')
+def init_distance_ring():
+    distance_ring = [[0 for _ in range(8)] for _ in range(64)]
+    for s1 in range(64):
+        s1_rank = s1 >> 3
+        s1_file = s1 & 7
+        for s2 in range(64):
+            if s1 != s2:
+                s2_rank = s2 >> 3
+                s2_file = s2 & 7
+                distance = max(abs(s2_rank - s1_rank), abs(s2_file - s1_file))
+                distance_ring[s1][distance] |= (1 << s2)
+    return distance_ring
+
 
 # Allows bitwise shift direction based on colour
 pawn_shift = [None for _ in range(2)]
@@ -201,27 +196,40 @@ pawn_push[BLACK] = -NORTH
 
 # Gets the bitboard of squares adjacent to the king, plus the squares
 # two ranks in front for a king on its first rank
-king_ring = [[None for _ in range(64)] for _ in range(2)]
-for colour in range(2):
-    for sq in range(64):
-        king_ring[colour][sq] = pseudo_attacks[KING][sq]
-
-        rank_num = sq >> 3
-        file_num = sq & 7
-
-        if rank_num ^ (colour * 7) == 0:
-            king_ring[colour][sq] |= pseudo_attacks[KING][sq + pawn_push[colour]]
-        if file_num == 0:
-            king_ring[colour][sq] |= pseudo_attacks[KING][sq + EAST]
-        elif file_num == 7:
-            king_ring[colour][sq] |= pseudo_attacks[KING][sq - EAST]
-    
-
-# Generates the indices of the set bits of a given bitboard
-def gen_bitboard_indices(bb):
-    while bb:
-        yield bit_scan1(bb)
-        bb &= bb - 1
+@registry.register('king_ring')
+def init_king_ring():
+    from attack_tables import pseudo_attacks
+
+    king_ring = [[None for _ in range(64)] for _ in range(2)]
+    for colour in range(2):
+        for sq in range(64):
+            king_ring[colour][sq] = pseudo_attacks[KING][sq]
+
+            rank_num = sq >> 3
+            file_num = sq & 7
+
+            if rank_num ^ (colour * 7) == 0:
+                king_ring[colour][sq] |= pseudo_attacks[KING][sq + pawn_push[colour]]
+            if file_num == 0:
+                king_ring[colour][sq] |= pseudo_attacks[KING][sq + EAST]
+            elif file_num == 7:
+                king_ring[colour][sq] |= pseudo_attacks[KING][sq - EAST]
+    return king_ring
+
+
+# Gets the indices of the set bits of each byte value, indexed by the byte number within a bitboard
+byte_indices = [[tuple(sq + (byte_num << 3) for sq in range(8) if byte & (1 << sq)) for byte in range(256)]
+                for byte_num in range(8)]
+(byte_indices_0, byte_indices_1, byte_indices_2, byte_indices_3,
+ byte_indices_4, byte_indices_5, byte_indices_6, byte_indices_7) = byte_indices
+
+
+# Gets a tuple of the indices of the set bits of a given bitboard, in increasing order
+# Joining the indices for each byte is faster than scanning one bit at a time, except for single bits
+def bitboard_indices(bb):
+    byte_0, byte_1, byte_2, byte_3, byte_4, byte_5, byte_6, byte_7 = bb.to_bytes(8, 'little')
+    return (byte_indices_0[byte_0] + byte_indices_1[byte_1] + byte_indices_2[byte_2] + byte_indices_3[byte_3]
+            + byte_indices_4[byte_4] + byte_indices_5[byte_5] + byte_indices_6[byte_6] + byte_indices_7[byte_7])
 
 
 # Flips a bitboard vertically
@@ -1,7 +1,7 @@
 from collections import namedtuple
 from functools import reduce
 from itertools import chain, combinations
-from random import getrandbits
+from random import Random
 
 _64BITS = 0xFFFFFFFFFFFFFFFF
 
@@ -84,6 +84,13 @@ MATERIAL[ROOK] = (1289, 1378)
 MATERIAL[QUEEN] = (2529, 2687)
 MATERIAL[KING] = (20000, 20000)
 
+# Midgame material value of each piece type, excluding pawns and kings
+NON_PAWN_MATERIAL = [0, 0, MATERIAL[KNIGHT][MIDGAME], MATERIAL[BISHOP][MIDGAME], MATERIAL[ROOK][MIDGAME],
+                     MATERIAL[QUEEN][MIDGAME], 0]
+
+# Weight of each piece type in the game phase, which adds up to 24 with all pieces on the board
+PHASE_WEIGHT = [0, 0, 1, 1, 2, 4, 0]
+
 # Penalty for doubled pawns
 DOUBLED = (11, 56)
 
@@ -96,10 +103,14 @@ BACKWARD = (9, 24)
 MATE = 100000
 DRAW = 0
 FUTILITY_MARGIN = 400
+DELTA_MARGIN = 256
 
 # Not using math.inf, as 'INFINITY + 1' is sometimes needed
 INFINITY = 1000000
 
+# Number of plies for which search buffers are preallocated
+MAX_PLY = 128
+
 # Castling sides
 KINGSIDE = 1
 QUEENSIDE = 1 << 2
@@ -112,10 +123,13 @@ CASTLING_RIGHTS = (W_KINGSIDE,
                    B_QUEENSIDE) = list((1 << i for i in range(4)))
 
 # Move generation types
+# CAPTURES also includes queen promotions, and QUIETS includes underpromotions
+# QUIET_CHECKS is non-capturing moves which give check, apart from promotions and castling
 ALL = 0
 QUIETS = 1
 CAPTURES = 2
 EVASIONS = 3
+QUIET_CHECKS = 4
 
 # Move types
 NORMAL = 0
@@ -145,28 +159,32 @@ PawnEntry = namedtuple('PawnEntry', 'key score_mg score_eg')
 
 MaterialEntry = namedtuple('MaterialEntry', 'key material_score imbalance')
 
+# Zobrist keys come from a fixed seed, so that keys, and the search results depending on them,
+# are the same in every process
+zobrist_random = Random(0x5EED)
+
 # Random 64-bit integer for each combination of square and piece
 ZOBRIST_BOARD = [[None for _ in range(64)] for _ in range(16)]
 for piece in PIECES:
     for sq in range(64):
-        ZOBRIST_BOARD[piece][sq] = getrandbits(64)
+        ZOBRIST_BOARD[piece][sq] = zobrist_random.getrandbits(64)
 
 # Random 64-bit integer for each en-passant file
 ZOBRIST_ENPASSANT = [None for _ in range(8)]
 for file_num in range(8):
-    ZOBRIST_ENPASSANT[file_num] = getrandbits(64)
+    ZOBRIST_ENPASSANT[file_num] = zobrist_random.getrandbits(64)
 
 # Random 64-bit integer for each combination of castling rights
 ZOBRIST_CASTLING = [0 for _ in range(16)]
 # Individual castling rights
 for cr in CASTLING_RIGHTS:
-    ZOBRIST_CASTLING[cr] = getrandbits(64)
+    ZOBRIST_CASTLING[cr] = zobrist_random.getrandbits(64)
 # Combinations of castling rights
 for length in range(2, 5):
     combos = combinations(CASTLING_RIGHTS, length)
     for combo in combos:
         index = reduce(lambda x, y: x | y, combo)
         for cr in combo:
-            ZOBRIST_CASTLING[index] ^= cr
+            ZOBRIST_CASTLING[index] ^= ZOBRIST_CASTLING[cr]
 
-ZOBRIST_COLOUR = getrandbits(64)
+ZOBRIST_COLOUR = zobrist_random.getrandbits(64)
@@ -1,17 +1,16 @@
 from gmpy2 import bit_scan1, popcount
 
-from common import (gen_bitboard_indices, adjacent_files, rank_of, pawn_shift,
+from common import (bitboard_indices, adjacent_files, rank_of, pawn_shift,
                     forward_fill, distance_ring, forward_ranks)
 
-from consts import (W_KNIGHT, W_BISHOP, W_ROOK, W_QUEEN, B_KNIGHT, B_BISHOP,
-                    B_ROOK, B_QUEEN, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+from consts import (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
                     WHITE, BLACK, PIECE_TYPES, MATERIAL, MIDGAME, ENDGAME, COLOURS,
                     NORTH, NORTHEAST, NORTHWEST, PawnEntry, MaterialEntry, _64BITS,
                     RANK_1_BB, RANK_2_BB, RANK_7_BB, RANK_8_BB, A_FILE_BB, H_FILE_BB,
                     RANK_1, RANK_3, A_FILE, B_FILE, G_FILE, H_FILE, KINGSIDE,
                     QUEENSIDE, ISOLATED, DOUBLED, BACKWARD)
 
-from attack_tables import (pseudo_attacks, bishop_masks, rook_masks, batk_table, ratk_table)
+from attack_tables import bishop_attacks, rook_attacks
 
 from eval_tables import (connected_bonus, mobility, player_imbalance, enemy_imbalance,
                          shelter_strength, unblocked_storm)
@@ -35,24 +34,26 @@ class Evaluate:
     def imbalance(self, position, colour):
         imbalance_score = 0
 
-        player_bishop_pair = True if popcount(position.piece_bb[(colour << 3) | BISHOP]) > 1 else False
+        piece_count = position.piece_count
+
+        player_bishop_pair = True if piece_count[(colour << 3) | BISHOP] > 1 else False
         if player_bishop_pair:
-            enemy_bishop_pair = True if popcount(position.piece_bb[((colour ^ 1) << 3) | BISHOP]) > 1 else False
+            enemy_bishop_pair = True if piece_count[((colour ^ 1) << 3) | BISHOP] > 1 else False
             temp = (player_imbalance[0][0] * player_bishop_pair
                     + enemy_imbalance[0][0] * enemy_bishop_pair)
             imbalance_score += player_bishop_pair * temp
             
         for piece_type_one in PIECE_TYPES[:QUEEN]:
-            ours = position.piece_bb[(colour << 3) | piece_type_one]
-            if not popcount(ours):
+            ours = piece_count[(colour << 3) | piece_type_one]
+            if not ours:
                 continue
             temp = 0
             for piece_type_two in PIECE_TYPES[:piece_type_one]:
-                player_pieces = position.piece_bb[(colour << 3) | piece_type_two]
-                enemy_pieces = position.piece_bb[((colour ^ 1) << 3) | piece_type_two]
-                temp += (player_imbalance[piece_type_one][piece_type_two] * popcount(player_pieces)
-                         + enemy_imbalance[piece_type_one][piece_type_two] * popcount(enemy_pieces))
-            imbalance_score += popcount(ours) * temp
+                player_pieces = piece_count[(colour << 3) | piece_type_two]
+                enemy_pieces = piece_count[((colour ^ 1) << 3) | piece_type_two]
+                temp += (player_imbalance[piece_type_one][piece_type_two] * player_pieces
+                         + enemy_imbalance[piece_type_one][piece_type_two] * enemy_pieces)
+            imbalance_score += ours * temp
             
         return imbalance_score
 
@@ -74,14 +75,11 @@ class Evaluate:
             score_eg += imbalance_score
 
             material_score = [0, 0]
-            for sq in gen_bitboard_indices(position.occupancy):
-                piece = position.squares[sq]
-                if piece >> 3 == WHITE:
-                    material_score[MIDGAME] += MATERIAL[piece & 7][MIDGAME]
-                    material_score[ENDGAME] += MATERIAL[piece & 7][ENDGAME]
-                else:
-                    material_score[MIDGAME] -= MATERIAL[piece & 7][MIDGAME]
-                    material_score[ENDGAME] -= MATERIAL[piece & 7][ENDGAME]
+            for piece_type in PIECE_TYPES:
+                count = (position.piece_count[(WHITE << 3) | piece_type]
+                         - position.piece_count[(BLACK << 3) | piece_type])
+                material_score[MIDGAME] += MATERIAL[piece_type][MIDGAME] * count
+                material_score[ENDGAME] += MATERIAL[piece_type][ENDGAME] * count
             score_mg += material_score[MIDGAME]
             score_eg += material_score[ENDGAME]
             
@@ -104,34 +102,35 @@ class Evaluate:
 
         return area
 
-    def evaluate_mobility(self, position, mobility_bb):
-        mobility_area = [0, 0]
+    def evaluate_mobility(self, position):
         mobility_score_mg = [0, 0]
         mobility_score_eg = [0, 0]
-        
-        mobility_area[WHITE] = self.get_mobility_area(position, WHITE)
-        mobility_area[BLACK] = self.get_mobility_area(position, BLACK)
 
-        for sq in gen_bitboard_indices(mobility_bb):
-            piece = position.squares[sq]
-            piece_type = piece & 7
-            piece_colour = piece >> 3
-            
-            if piece_type == KNIGHT:
-                moves = pseudo_attacks[KNIGHT][sq]
-            elif piece_type == BISHOP:
-                moves = batk_table[sq][(position.occupancy ^ position.piece_bb[(piece_colour << 3) | QUEEN]) & bishop_masks[sq]]
-            elif piece_type == ROOK:
-                moves = ratk_table[sq][(position.occupancy ^ position.piece_bb[(piece_colour << 3) | ROOK]
-                                        ^ position.piece_bb[(piece_colour << 3) | QUEEN]) & rook_masks[sq]]
-            elif piece_type == QUEEN:
-                moves = ratk_table[sq][position.occupancy & rook_masks[sq]] | batk_table[sq][position.occupancy & bishop_masks[sq]]
-
-            moves &= mobility_area[piece_colour]
-            
-            move_count = popcount(moves)
-            mobility_score_mg[piece_colour] += mobility[piece_type][move_count][MIDGAME]
-            mobility_score_eg[piece_colour] += mobility[piece_type][move_count][ENDGAME]
+        # Attacks are shared with the rest of the position, and recomputed only when a bishop or rook
+        # sees through one of its own sliders
+        attacks = position.get_attack_info().attacks
+        occ = position.occupancy
+
+        for colour in COLOURS:
+            mobility_area = self.get_mobility_area(position, colour)
+            queens = position.piece_bb[(colour << 3) | QUEEN]
+            rooks_queens = position.piece_bb[(colour << 3) | ROOK] | queens
+
+            for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN):
+                piece_mobility = mobility[piece_type]
+                piece_bb = position.piece_bb[(colour << 3) | piece_type]
+                while piece_bb:
+                    sq = bit_scan1(piece_bb)
+                    moves = attacks[sq]
+                    if piece_type == BISHOP and moves & queens:
+                        moves = bishop_attacks(sq, occ ^ queens)
+                    elif piece_type == ROOK and moves & rooks_queens:
+                        moves = rook_attacks(sq, occ ^ rooks_queens)
+
+                    move_count = popcount(moves & mobility_area)
+                    mobility_score_mg[colour] += piece_mobility[move_count][MIDGAME]
+                    mobility_score_eg[colour] += piece_mobility[move_count][ENDGAME]
+                    piece_bb &= piece_bb - 1
 
         score_mg = mobility_score_mg[WHITE] - mobility_score_mg[BLACK]
         score_eg = mobility_score_eg[WHITE] - mobility_score_eg[BLACK]
@@ -155,7 +154,7 @@ class Evaluate:
             enemy_pawn_attacks = (pawn_shift[colour ^ 1](enemy_pawns, NORTHEAST)
                                   | pawn_shift[colour ^ 1](enemy_pawns, NORTHWEST))
 
-            for sq in gen_bitboard_indices(player_pawns):
+            for sq in bitboard_indices(player_pawns):
                 pawn_bb = 1 << sq
                 adjacent_squares = adjacent_files[sq] & rank_of[sq] 
                 adjacent_pawns = adjacent_files[sq] & player_pawns
@@ -295,14 +294,7 @@ class Evaluate:
 
     # Evaluate score from white's perspective, then returned negated value if current player is black
     def evaluate(self, position):
-        knights = position.piece_bb[W_KNIGHT] | position.piece_bb[B_KNIGHT]
-        bishops = position.piece_bb[W_BISHOP] | position.piece_bb[B_BISHOP]
-        rooks = position.piece_bb[W_ROOK] | position.piece_bb[B_ROOK]
-        queens = position.piece_bb[W_QUEEN] | position.piece_bb[B_QUEEN]
-        
-        phase = 24 - (popcount(knights | bishops)
-                      + (popcount(rooks) * 2)
-                      + (popcount(queens) * 4))
+        phase = 24 - position.game_phase
         phase = ((phase * 256) + 12) // 24
         
         score_mg = 0
@@ -323,8 +315,7 @@ class Evaluate:
         score_eg += pawn_score_eg
 
         # Mobility
-        mobility_bb = knights | bishops | rooks | queens
-        mobility_score_mg, mobility_score_eg = self.evaluate_mobility(position, mobility_bb)
+        mobility_score_mg, mobility_score_eg = self.evaluate_mobility(position)
         score_mg += mobility_score_mg
         score_eg += mobility_score_eg
 
@@ -1,3 +1,8 @@
+from array import array
+
+import numpy as np
+
+
 # Returns rook attacks in the north direction
 def ratks_n(sq, occ):
     sq = 1 << sq
@@ -194,3 +199,62 @@ def rook_attacks(sq, occ):
 # Returns all of the bishop attacks from the given square with the specified occupancy
 def bishop_attacks(sq, occ):
     return batks_ne(sq, occ) | batks_se(sq, occ) | batks_sw(sq, occ) | batks_nw(sq, occ)
+
+
+# Vectorised Kogge-Stone fills, which compute the attacks of arrays of sliders at once
+# Sliders and occupancies are given as uint64 NumPy arrays of bitboards, with one slider or more in each
+NOT_A_FILE = np.uint64(0xFEFEFEFEFEFEFEFE)
+NOT_H_FILE = np.uint64(0x7F7F7F7F7F7F7F7F)
+ALL_SQUARES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+# Returns the attacks of the sliders in one direction, given by the shift of a single step
+# The mask removes squares reached by wrapping around the edge of the board
+def occluded_fill(sliders, empty, shift, mask):
+    empty = empty & mask
+    if shift > 0:
+        for step in (shift, shift * 2, shift * 4):
+            sliders = sliders | (empty & (sliders << np.uint64(step)))
+            empty = empty & (empty << np.uint64(step))
+        return (sliders << np.uint64(shift)) & mask
+    else:
+        for step in (-shift, -shift * 2, -shift * 4):
+            sliders = sliders | (empty & (sliders >> np.uint64(step)))
+            empty = empty & (empty >> np.uint64(step))
+        return (sliders >> np.uint64(-shift)) & mask
+
+
+# Returns all of the rook attacks of the sliders with the specified occupancies
+def rook_attacks_array(sliders, occ):
+    empty = ~occ
+    return (occluded_fill(sliders, empty, 8, ALL_SQUARES) | occluded_fill(sliders, empty, 1, NOT_A_FILE)
+            | occluded_fill(sliders, empty, -8, ALL_SQUARES) | occluded_fill(sliders, empty, -1, NOT_H_FILE))
+
+
+# Returns all of the bishop attacks of the sliders with the specified occupancies
+def bishop_attacks_array(sliders, occ):
+    empty = ~occ
+    return (occluded_fill(sliders, empty, 9, NOT_A_FILE) | occluded_fill(sliders, empty, -7, NOT_A_FILE)
+            | occluded_fill(sliders, empty, -9, NOT_H_FILE) | occluded_fill(sliders, empty, 7, NOT_H_FILE))
+
+
+# Returns an array of all subsets of the mask, by depositing the bits of each index onto the mask squares
+def mask_subsets(mask):
+    squares = [sq for sq in range(64) if mask & (1 << sq)]
+    index = np.arange(1 << len(squares), dtype=np.uint64)
+    subsets = np.zeros(1 << len(squares), dtype=np.uint64)
+    for bit, sq in enumerate(squares):
+        subsets |= ((index >> np.uint64(bit)) & np.uint64(1)) << np.uint64(sq)
+    return subsets
+
+
+# Generates a flat table of slider attacks for all squares, indexed by the offset of the square
+# plus the magic index of the masked occupancy
+def gen_magic_table(masks, magics, shifts, offsets, slider_attacks_array):
+    table = np.zeros(offsets[64], dtype=np.uint64)
+    for sq in range(64):
+        occ = mask_subsets(masks[sq])
+        magic_index = (occ * np.uint64(magics[sq])) >> np.uint64(shifts[sq])
+        table[offsets[sq] + magic_index.astype(np.int64)] = slider_attacks_array(np.uint64(1 << sq), occ)
+
+    return array('Q', table.tobytes())
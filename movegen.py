@@ -2,50 +2,98 @@ from gmpy2 import bit_scan1
 
 from common import pawn_shift
 
-from attack_tables import (batk_table, ratk_table, bishop_masks, rook_masks,
+from attack_tables import (bishop_attacks, rook_attacks, queen_attacks,
                            pseudo_attacks)
 
 from consts import (QUIETS, CAPTURES, ALL, WHITE, NORTH, NORTHEAST, NORTHWEST,
-                    RANK_2_BB, RANK_3_BB, RANK_6_BB, RANK_7_BB, A_FILE_BB,
-                    H_FILE_BB, PROMOTION, KNIGHT_PROMOTION, BISHOP_PROMOTION,
+                    RANK_1_BB, RANK_2_BB, RANK_3_BB, RANK_4_BB, RANK_5_BB, RANK_6_BB, RANK_7_BB,
+                    RANK_8_BB, A_FILE_BB, H_FILE_BB, _64BITS, PROMOTION, KNIGHT_PROMOTION, BISHOP_PROMOTION,
                     ROOK_PROMOTION, QUEEN_PROMOTION, KNIGHT, KING)
 
 
-def get_king_moves(sq, colour, move_type, occ, player_occ, move_list):
-    moves = pseudo_attacks[KING][sq]
-
-    if move_type == QUIETS:
-        moves &= ~occ
-    elif move_type == CAPTURES:
-        moves &= player_occ[colour ^ 1]
-    elif move_type == ALL:
-        moves &= ~player_occ[colour]
-
-    while moves:
-        index = bit_scan1(moves)
-        moves &= moves - 1
-        move_list.append((sq << 6) + index)
-
-
-def get_knight_moves(sq, colour, move_type, occ, player_occ, move_list):
-    moves = pseudo_attacks[KNIGHT][sq]
-
-    if move_type == QUIETS:
-        moves &= ~occ
-    elif move_type == CAPTURES:
-        moves &= player_occ[colour ^ 1]
-    elif move_type == ALL:
-        moves &= ~player_occ[colour]
-
-    while moves:
-        index = bit_scan1(moves)
-        moves &= moves - 1
-        move_list.append((sq << 6) + index)
-
-
-def get_pawn_moves(bitboard, colour, move_type, occ, player_occ, move_list):
+# Gets the encoded moves of a leaper piece from each square, keyed by the bitboard of destination squares
+# Every subset of the attacks from the square is a key, so a set of moves is found with one lookup
+def init_leaper_moves(piece_type):
+    leaper_moves = [{} for _ in range(64)]
+    for sq in range(64):
+        attacks = pseudo_attacks[piece_type][sq]
+        leaper_moves[sq][0] = ()
+        targets = attacks & -attacks
+        # Produce moves for all subsets of the attacks, in increasing order, so that the moves
+        # for the subset without the lowest square have already been produced
+        while targets:
+            lowest = targets & -targets
+            leaper_moves[sq][targets] = ((sq << 6) + lowest.bit_length() - 1,) + leaper_moves[sq][targets ^ lowest]
+            targets = (targets - attacks) & attacks  # Carry-Rippler
+
+    return leaper_moves
+
+
+king_moves = init_leaper_moves(KING)
+knight_moves = init_leaper_moves(KNIGHT)
+
+
+def get_king_moves(sq, occ, targets, move_list):
+    move_list.extend(king_moves[sq][pseudo_attacks[KING][sq] & targets])
+
+
+def get_knight_moves(sq, occ, targets, move_list):
+    move_list.extend(knight_moves[sq][pseudo_attacks[KNIGHT][sq] & targets])
+
+
+# Gets the encoded pawn moves for each byte of a bitboard of destination squares, indexed by the byte
+# number and the byte value. The source square is the destination square minus the shift, and one move
+# is produced for each flag, for each destination square on the given ranks
+def init_pawn_moves(shift, flags, dst_ranks):
+    pawn_moves = []
+    for byte_num in range(8):
+        if not dst_ranks & (0xFF << (byte_num << 3)):
+            pawn_moves.append(no_pawn_moves)
+            continue
+
+        byte_moves = [() for _ in range(256)]
+        for byte in range(1, 256):
+            lowest = byte & -byte
+            sq = (byte_num << 3) + lowest.bit_length() - 1
+            # Join the moves for the lowest square to the moves for the rest of the byte
+            if 0 <= sq - shift < 64:
+                byte_moves[byte] = tuple(flag + ((sq - shift) << 6) + sq for flag in flags) + byte_moves[byte ^ lowest]
+            else:
+                byte_moves[byte] = byte_moves[byte ^ lowest]
+        pawn_moves.append(byte_moves)
+
+    return pawn_moves
+
+
+# Pawn move tables, indexed by the shift from the source square to the destination square
+# Queen promotions are produced with captures, and underpromotions with quiet moves
+no_pawn_moves = [() for _ in range(256)]
+pawn_moves = {}
+queen_promotions = {}
+underpromotions = {}
+for shift in (NORTH, NORTHWEST, NORTHEAST, -NORTH, -NORTHWEST, -NORTHEAST):
+    promotion_rank = RANK_8_BB if shift > 0 else RANK_1_BB
+    pawn_moves[shift] = init_pawn_moves(shift, (0,), _64BITS ^ RANK_1_BB ^ RANK_8_BB)
+    queen_promotions[shift] = init_pawn_moves(shift, (PROMOTION + QUEEN_PROMOTION,), promotion_rank)
+    underpromotions[shift] = init_pawn_moves(shift, (PROMOTION + KNIGHT_PROMOTION, PROMOTION + BISHOP_PROMOTION,
+                                                     PROMOTION + ROOK_PROMOTION), promotion_rank)
+pawn_moves[NORTH * 2] = init_pawn_moves(NORTH * 2, (0,), RANK_4_BB)
+pawn_moves[-NORTH * 2] = init_pawn_moves(-NORTH * 2, (0,), RANK_5_BB)
+
+
+# Adds the moves to all destination squares of a shifted pawn bitboard, joining the moves for each byte
+def extend_pawn_moves(targets, byte_moves, move_list):
+    if targets:
+        byte_0, byte_1, byte_2, byte_3, byte_4, byte_5, byte_6, byte_7 = targets.to_bytes(8, 'little')
+        move_list.extend(byte_moves[0][byte_0] + byte_moves[1][byte_1] + byte_moves[2][byte_2]
+                         + byte_moves[3][byte_3] + byte_moves[4][byte_4] + byte_moves[5][byte_5]
+                         + byte_moves[6][byte_6] + byte_moves[7][byte_7])
+
+
+# Moves are only generated to the target squares. Queen promotions by pushing are generated with captures
+def get_pawn_moves(bitboard, colour, move_type, occ, enemy_occ, targets, move_list):
     empty = ~occ
-    enemy_occ = player_occ[colour ^ 1]
+    capture_targets = enemy_occ & targets
 
     if colour == WHITE:
         third_rank = RANK_3_BB
@@ -71,85 +119,37 @@ def get_pawn_moves(bitboard, colour, move_type, occ, player_occ, move_list):
 
     # Captures and queen promotions
     if move_type == CAPTURES or move_type == ALL:
-        left_atk = pawn_shift[colour]((pawns_not_promoting & ~left_file), NORTHWEST) & enemy_occ
-        right_atk = pawn_shift[colour]((pawns_not_promoting & ~right_file), NORTHEAST) & enemy_occ
-
-        promoted_push = pawn_shift[colour](promoting_pawns, NORTH) & empty
-        promoted_left_atk = pawn_shift[colour]((promoting_pawns & ~left_file), NORTHWEST) & enemy_occ
-        promoted_right_atk = pawn_shift[colour]((promoting_pawns & ~right_file), NORTHEAST) & enemy_occ
-
-        while left_atk:
-            index = bit_scan1(left_atk)
-            left_atk &= left_atk - 1
-            move_list.append(((index - left_atk_shift) << 6) + index)
-            
-        while right_atk:
-            index = bit_scan1(right_atk)
-            right_atk &= right_atk - 1
-            move_list.append(((index - right_atk_shift) << 6) + index)
-            
-        while promoted_push:
-            index = bit_scan1(promoted_push)
-            promoted_push &= promoted_push - 1
-            from_to = ((index - one_step_shift) << 6) + index
-            move_list.append(PROMOTION + QUEEN_PROMOTION + from_to)
-            
-        while promoted_left_atk:
-            index = bit_scan1(promoted_left_atk)
-            promoted_left_atk &= promoted_left_atk - 1
-            from_to = ((index - left_atk_shift) << 6) + index
-            move_list.append(PROMOTION + QUEEN_PROMOTION + from_to)
-            
-        while promoted_right_atk:
-            index = bit_scan1(promoted_right_atk)
-            promoted_right_atk &= promoted_right_atk - 1
-            from_to = ((index - right_atk_shift) << 6) + index
-            move_list.append(PROMOTION + QUEEN_PROMOTION + from_to)
+        left_atk = pawn_shift[colour]((pawns_not_promoting & ~left_file), NORTHWEST) & capture_targets
+        right_atk = pawn_shift[colour]((pawns_not_promoting & ~right_file), NORTHEAST) & capture_targets
+        extend_pawn_moves(left_atk, pawn_moves[left_atk_shift], move_list)
+        extend_pawn_moves(right_atk, pawn_moves[right_atk_shift], move_list)
+
+        if promoting_pawns:
+            promoted_push = pawn_shift[colour](promoting_pawns, NORTH) & empty & targets
+            promoted_left_atk = pawn_shift[colour]((promoting_pawns & ~left_file), NORTHWEST) & capture_targets
+            promoted_right_atk = pawn_shift[colour]((promoting_pawns & ~right_file), NORTHEAST) & capture_targets
+            extend_pawn_moves(promoted_push, queen_promotions[one_step_shift], move_list)
+            extend_pawn_moves(promoted_left_atk, queen_promotions[left_atk_shift], move_list)
+            extend_pawn_moves(promoted_right_atk, queen_promotions[right_atk_shift], move_list)
 
     # Non-captures and underpromotions
     if move_type == QUIETS or move_type == ALL:
         one_step = pawn_shift[colour](pawns_not_promoting, NORTH) & empty
         two_steps = pawn_shift[colour]((one_step & third_rank), NORTH) & empty
+        extend_pawn_moves(one_step & targets, pawn_moves[one_step_shift], move_list)
+        extend_pawn_moves(two_steps & targets, pawn_moves[two_step_shift], move_list)
+
+        if promoting_pawns:
+            promoted_push = pawn_shift[colour](promoting_pawns, NORTH) & empty & targets
+            promoted_left_atk = pawn_shift[colour]((promoting_pawns & ~left_file), NORTHWEST) & capture_targets
+            promoted_right_atk = pawn_shift[colour]((promoting_pawns & ~right_file), NORTHEAST) & capture_targets
+            extend_pawn_moves(promoted_push, underpromotions[one_step_shift], move_list)
+            extend_pawn_moves(promoted_left_atk, underpromotions[left_atk_shift], move_list)
+            extend_pawn_moves(promoted_right_atk, underpromotions[right_atk_shift], move_list)
 
-        promoted_push = pawn_shift[colour](promoting_pawns, NORTH) & empty
-        promoted_left_atk = pawn_shift[colour]((promoting_pawns & ~left_file), NORTHWEST) & enemy_occ
-        promoted_right_atk = pawn_shift[colour]((promoting_pawns & ~right_file), NORTHEAST) & enemy_occ
-
-        while one_step:
-            index = bit_scan1(one_step)
-            one_step &= one_step - 1
-            move_list.append(((index - one_step_shift) << 6) + index)
-            
-        while two_steps:
-            index = bit_scan1(two_steps)
-            two_steps &= two_steps - 1
-            move_list.append(((index - two_step_shift) << 6) + index)
-            
-        while promoted_push:
-            index = bit_scan1(promoted_push)
-            promoted_push &= promoted_push - 1
-            generate_underpromotions(index - one_step_shift, index, move_list)
-            
-        while promoted_left_atk:
-            index = bit_scan1(promoted_left_atk)
-            promoted_left_atk &= promoted_left_atk - 1
-            generate_underpromotions(index - left_atk_shift, index, move_list)
-            
-        while promoted_right_atk:
-            index = bit_scan1(promoted_right_atk)
-            promoted_right_atk &= promoted_right_atk - 1
-            generate_underpromotions(index - right_atk_shift, index, move_list)
-
-
-def get_rook_moves(sq, colour, move_type, occ, player_occ, move_list):   
-    moves = ratk_table[sq][occ & rook_masks[sq]]
-
-    if move_type == QUIETS:
-        moves &= ~occ
-    elif move_type == CAPTURES:
-        moves &= player_occ[colour ^ 1]
-    elif move_type == ALL:
-        moves &= ~player_occ[colour]
+
+def get_rook_moves(sq, occ, targets, move_list):
+    moves = rook_attacks(sq, occ) & targets
 
     while moves:
         index = bit_scan1(moves)
@@ -157,15 +157,8 @@ def get_rook_moves(sq, colour, move_type, occ, player_occ, move_list):
         move_list.append((sq << 6) + index)
 
 
-def get_bishop_moves(sq, colour, move_type, occ, player_occ, move_list):
-    moves = batk_table[sq][occ & bishop_masks[sq]]
-
-    if move_type == QUIETS:
-        moves &= ~occ
-    elif move_type == CAPTURES:
-        moves &= player_occ[colour ^ 1]
-    elif move_type == ALL:
-        moves &= ~player_occ[colour]
+def get_bishop_moves(sq, occ, targets, move_list):
+    moves = bishop_attacks(sq, occ) & targets
 
     while moves:
         index = bit_scan1(moves)
@@ -173,15 +166,8 @@ def get_bishop_moves(sq, colour, move_type, occ, player_occ, move_list):
         move_list.append((sq << 6) + index)
 
 
-def get_queen_moves(sq, colour, move_type, occ, player_occ, move_list):
-    moves = batk_table[sq][occ & bishop_masks[sq]] | ratk_table[sq][occ & rook_masks[sq]]
-
-    if move_type == QUIETS:
-        moves &= ~occ
-    elif move_type == CAPTURES:
-        moves &= player_occ[colour ^ 1]
-    elif move_type == ALL:
-        moves &= ~player_occ[colour]
+def get_queen_moves(sq, occ, targets, move_list):
+    moves = queen_attacks(sq, occ) & targets
 
     while moves:
         index = bit_scan1(moves)
@@ -189,16 +175,10 @@ def get_queen_moves(sq, colour, move_type, occ, player_occ, move_list):
         move_list.append((sq << 6) + index)
 
 
+# Queen promotions come first, as they are searched first
 def generate_promotions(src_sq, dst_sq, move_list):
     from_to = (src_sq << 6) + dst_sq
-    move_list.append(PROMOTION + KNIGHT_PROMOTION + from_to)
-    move_list.append(PROMOTION + BISHOP_PROMOTION + from_to)
-    move_list.append(PROMOTION + ROOK_PROMOTION + from_to)
     move_list.append(PROMOTION + QUEEN_PROMOTION + from_to)
-
-
-def generate_underpromotions(src_sq, dst_sq, move_list):
-    from_to = (src_sq << 6) + dst_sq
     move_list.append(PROMOTION + KNIGHT_PROMOTION + from_to)
     move_list.append(PROMOTION + BISHOP_PROMOTION + from_to)
     move_list.append(PROMOTION + ROOK_PROMOTION + from_to)
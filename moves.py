@@ -0,0 +1,200 @@
+from gmpy2 import bit_scan1
+
+from common import regex_san, san_to_index, index_to_san, piece_int_to_string, pawn_push
+from consts import (NORMAL, PROMOTION, EN_PASSANT, CASTLING, NO_PIECE, PAWN, KNIGHT, BISHOP, ROOK, QUEEN,
+                    KING, WHITE, A_FILE_BB, RANK_1_BB, RANK_4_BB, RANK_5_BB, RANK_8_BB)
+from attack_tables import pawn_attacks
+
+
+# Lookup tables for decoding moves, indexed by the 16-bit move
+# Moves are encoded as: destination square (bits 0-5), source square (bits 6-11),
+# promotion piece type - 2 (bits 12-13) and move type (bits 14-15)
+src_of = [(move >> 6) & 0x3F for move in range(1 << 16)]
+dst_of = [move & 0x3F for move in range(1 << 16)]
+type_of = [move & (0x3 << 14) for move in range(1 << 16)]
+promotion_of = [((move >> 12) & 0x3) + 2 if move & (0x3 << 14) == PROMOTION else NO_PIECE
+                for move in range(1 << 16)]
+
+# Used for converting promotion pieces between letters and piece types
+promotion_string_to_int = {'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN}
+promotion_int_to_string = {KNIGHT: 'N', BISHOP: 'B', ROOK: 'R', QUEEN: 'Q'}
+
+# Used for converting SAN piece letters to piece types
+san_piece_to_int = {'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+
+
+def encode_move(src_index, dst_index, move_type=NORMAL, promotion=KNIGHT):
+    return move_type | ((promotion - 2) << 12) | (src_index << 6) | dst_index
+
+
+# Converts a move to UCI notation, such as 'e2e4' or 'e7e8q'
+def move_to_uci(move):
+    if not move:
+        return '0000'
+    uci = index_to_san[src_of[move]] + index_to_san[dst_of[move]]
+    if type_of[move] == PROMOTION:
+        uci += promotion_int_to_string[promotion_of[move]].lower()
+    return uci
+
+
+# Converts a move in UCI notation to a move in the given position
+def uci_to_move(position, uci):
+    if uci == '0000':
+        return 0
+    src_index = san_to_index[uci[0:2]]
+    dst_index = san_to_index[uci[2:4]]
+    piece_type = position.squares[src_index] & 7
+
+    if len(uci) == 5:
+        move = encode_move(src_index, dst_index, PROMOTION, promotion_string_to_int[uci[4].upper()])
+    elif piece_type == KING and abs(dst_index - src_index) == 2:
+        move = encode_move(src_index, dst_index, CASTLING)
+    elif piece_type == PAWN and dst_index == position.ep_square:
+        move = encode_move(src_index, dst_index, EN_PASSANT)
+    else:
+        move = encode_move(src_index, dst_index)
+
+    if not position.is_pseudo_legal(move) or not position.is_legal(move):
+        raise Exception("Illegal move: {}".format(uci))
+
+    return move
+
+
+# Converts a legal move in the given position to SAN, such as 'Nbd7', 'exd5' or 'e8=Q+'
+def move_to_san(position, move):
+    src_index = src_of[move]
+    dst_index = dst_of[move]
+    move_type = type_of[move]
+    piece_type = position.squares[src_index] & 7
+
+    if move_type == CASTLING:
+        san = 'O-O' if dst_index > src_index else 'O-O-O'
+    else:
+        is_capture = True if position.squares[dst_index] or move_type == EN_PASSANT else False
+
+        if piece_type == PAWN:
+            san = index_to_san[src_index][0] if is_capture else ''
+        else:
+            san = piece_int_to_string[piece_type] + disambiguation(position, move, piece_type)
+        if is_capture:
+            san += 'x'
+        san += index_to_san[dst_index]
+
+        if move_type == PROMOTION:
+            san += '=' + promotion_int_to_string[promotion_of[move]]
+
+    # Checkmate is only tested for moves giving check
+    if position.gives_check(move):
+        position.make_move(move)
+        san += '#' if position.is_checkmate() else '+'
+        position.undo_move()
+
+    return san
+
+
+# Gets the file and/or rank needed to tell a piece move apart from other legal moves of the same piece type
+# Other pieces reaching the destination are read from the attack maps, which are cached for each position
+def disambiguation(position, move, piece_type):
+    src_index = src_of[move]
+    dst_index = dst_of[move]
+
+    attacks = position.get_attack_info().attacks
+    others = position.piece_bb[(position.colour << 3) | piece_type] & ~(1 << src_index)
+
+    same_file = False
+    same_rank = False
+    is_ambiguous = False
+    while others:
+        sq = bit_scan1(others)
+        others &= others - 1
+        if not attacks[sq] & (1 << dst_index):
+            continue
+        if not position.is_legal(encode_move(sq, dst_index)):
+            continue
+        is_ambiguous = True
+        if sq & 7 == src_index & 7:
+            same_file = True
+        if sq >> 3 == src_index >> 3:
+            same_rank = True
+
+    if not is_ambiguous:
+        return ''
+    if not same_file:
+        return index_to_san[src_index][0]
+    if not same_rank:
+        return index_to_san[src_index][1]
+    return index_to_san[src_index]
+
+
+# Converts a move in SAN to a move in the given position
+# Only the pieces which could reach the destination square are considered
+def san_to_move(position, san):
+    match = regex_san.match(san)
+    if not match:
+        raise Exception("Invalid SAN: {}".format(san))
+
+    colour = position.colour
+
+    if match.group('kCastle') or match.group('qCastle'):
+        king_sqr = 4 ^ (colour * 56)
+        dst_index = king_sqr + 2 if match.group('kCastle') else king_sqr - 2
+        move = encode_move(king_sqr, dst_index, CASTLING)
+        if not position.is_pseudo_legal(move) or not position.is_legal(move):
+            raise Exception("Illegal move: {}".format(san))
+        return move
+
+    dst_index = san_to_index[match.group('dstSquare')]
+    dst_bb = 1 << dst_index
+    src_piece = match.group('srcPiece')
+    piece_type = san_piece_to_int[src_piece] if src_piece else PAWN
+    pieces = position.piece_bb[(colour << 3) | piece_type]
+
+    # Find the pieces of the given type which could move to the destination square
+    if piece_type == PAWN:
+        if match.group('action'):
+            candidates = pawn_attacks[colour ^ 1][dst_index] & pieces
+        else:
+            behind = dst_index - pawn_push[colour]
+            if position.squares[behind]:
+                candidates = (1 << behind) & pieces
+            else:
+                candidates = 0
+                if dst_bb & (RANK_4_BB if colour == WHITE else RANK_5_BB):
+                    candidates = (1 << (behind - pawn_push[colour])) & pieces
+    else:
+        candidates = position.attacks_from(dst_index, piece_type, colour, position.occupancy) & pieces
+
+    # Restrict the candidates to the file and/or rank given in the SAN
+    src_hint = match.group('srcHint')
+    if src_hint:
+        for char in src_hint:
+            if char in 'abcdefgh':
+                candidates &= A_FILE_BB << (ord(char) - ord('a'))
+            else:
+                candidates &= RANK_1_BB << ((ord(char) - ord('1')) * 8)
+
+    if match.group('promote'):
+        move_type = PROMOTION
+        promotion = promotion_string_to_int[match.group('promote')[1]]
+    else:
+        move_type = EN_PASSANT if piece_type == PAWN and dst_index == position.ep_square else NORMAL
+        promotion = KNIGHT
+
+    # Pawns reaching the last rank must promote
+    if piece_type == PAWN and dst_bb & (RANK_1_BB | RANK_8_BB) and move_type != PROMOTION:
+        raise Exception("Illegal move: {}".format(san))
+
+    found = None
+    while candidates:
+        sq = bit_scan1(candidates)
+        candidates &= candidates - 1
+        move = encode_move(sq, dst_index, move_type, promotion)
+        if position.is_pseudo_legal(move) and position.is_legal(move):
+            if found is not None:
+                raise Exception("Ambiguous move: {}".format(san))
+            found = move
+
+    if found is None:
+        raise Exception("Illegal move: {}".format(san))
+
+    return found
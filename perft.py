@@ -0,0 +1,241 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import starting_fen
+from position import Position
+from moves import move_to_uci, uci_to_move
+
+from consts import ALL
+
+
+# Standard perft positions and their known node counts, indexed by depth - 1
+PERFT_SUITE = [
+    (starting_fen,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603, 193690690]),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333, 15833292]),
+    ('r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+     [6, 264, 9467, 422333, 15833292]),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487, 89941194]),
+    ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594, 164075551]),
+    # Check evasions, where pawn pushes blocking the check are only promotions on the last rank
+    ('b6k/8/8/2P5/8/8/8/7K w - - 0 1',
+     [3, 25, 95, 1088, 5913, 71651]),
+    ('2n4r/rp3p1n/7b/pRpP2kp/PP2p2R/1N1P1Q2/5P2/2B1KB2 b - - 2 30',
+     [3, 133, 2687, 111494, 2437056]),
+]
+
+# Games played from a position and the FEN they should reach, which checks the move counters kept by make_move
+FEN_SUITE = [
+    (starting_fen, 'e2e4 e7e5 g1f3 b8c6',
+     'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3'),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 'e1g1 e8c8 a2a4 b4a3',
+     '2kr3r/p1ppqpb1/bn2pnp1/3PN3/4P3/p1N2Q1p/1PPBBPPP/R4RK1 w - - 0 3'),
+]
+
+
+# Counts the leaf nodes of the legal move tree to the given depth, used to test the move generator
+# Positions at depth 1 are counted by generating their moves without making them
+# If a dictionary is given as the hash table, node counts of subtrees are stored keyed by the
+# zobrist key and depth, so that transpositions are only counted once
+def perft(position, depth, tt=None):
+    if depth == 0:
+        return 1
+
+    # Reusable move lists, indexed by remaining depth
+    move_lists = [[] for _ in range(depth + 1)]
+    return count_nodes(position, depth, tt, move_lists)
+
+
+def count_nodes(position, depth, tt, move_lists):
+    if tt is not None and depth > 1:
+        key = (position.zobrist, depth)
+        if key in tt:
+            return tt[key]
+
+    move_list = position.get_legal_moves(ALL, move_lists[depth])
+    if depth == 1:
+        return len(move_list)
+
+    node_count = 0
+    for move in move_list:
+        position.make_move(move)
+        node_count += count_nodes(position, depth - 1, tt, move_lists)
+        position.undo_move()
+
+    if tt is not None:
+        tt[key] = node_count
+
+    return node_count
+
+
+# Counts the leaf nodes below each legal move of the position, returned as a list of (move, node count)
+def divide(position, depth, tt=None):
+    results = []
+    for move in position.get_legal_moves():
+        position.make_move(move)
+        results.append((move, perft(position, depth - 1, tt)))
+        position.undo_move()
+
+    return results
+
+
+# Gets the move sequences leading to each position the given number of plies below the position
+def split_moves(position, plies):
+    if plies == 0:
+        return [()]
+
+    sequences = []
+    for move in position.get_legal_moves():
+        position.make_move(move)
+        sequences.extend((move,) + moves for moves in split_moves(position, plies - 1))
+        position.undo_move()
+
+    return sequences
+
+
+# Hash table of each worker process, kept between subtrees so that transpositions between them are found
+worker_tt = None
+
+
+def init_worker(use_hash):
+    global worker_tt
+    worker_tt = {} if use_hash else None
+
+
+# Counts the leaf nodes of one subtree in a worker process, which builds its own position from the FEN
+# Returns the moves to the subtree, its node count and the time taken
+def perft_subtree(fen, moves, depth):
+    start_time = time.time()
+    position = Position(fen)
+    for move in moves:
+        position.make_move(move)
+
+    return moves, perft(position, depth, worker_tt), time.time() - start_time
+
+
+# Creates a process pool for parallel perft, using all cores if no number of workers is given
+def perft_pool(workers=None, use_hash=False):
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(use_hash,))
+
+
+# Counts the leaf nodes in parallel, by splitting the tree into the subtrees below each position the given
+# number of plies from the root, which are counted by the process pool
+# Returns a list of (moves to the subtree, node count, time taken) in move generation order
+def parallel_perft(fen, depth, pool, split_plies=1):
+    split_plies = max(0, min(split_plies, depth - 1))
+    sequences = split_moves(Position(fen), split_plies)
+    futures = [pool.submit(perft_subtree, fen, moves, depth - split_plies) for moves in sequences]
+
+    return [future.result() for future in futures]
+
+
+# Checks the node counts of the standard positions, up to the given number of nodes for each count,
+# and the FENs reached by the games of the FEN suite
+# Counts are split across a process pool if more than one job is given
+# Returns the number of counts which do not match
+def run_suite(max_nodes, use_hash=False, jobs=1):
+    failures = 0
+    total_nodes = 0
+    start_time = time.time()
+    pool = perft_pool(jobs or None, use_hash) if jobs != 1 else None
+
+    for fen, node_counts in PERFT_SUITE:
+        position = Position(fen)
+        for depth, expected in enumerate(node_counts, 1):
+            if expected > max_nodes:
+                break
+
+            if pool:
+                node_count = sum(result[1] for result in parallel_perft(fen, depth, pool))
+            else:
+                node_count = perft(position, depth, {} if use_hash else None)
+            total_nodes += node_count
+            if node_count != expected:
+                failures += 1
+            print("{} depth {}: {} {}".format(fen, depth, node_count,
+                                              "OK" if node_count == expected else "FAIL, expected {}".format(expected)))
+
+    if pool:
+        pool.shutdown()
+
+    for fen, moves, expected in FEN_SUITE:
+        position = Position(fen)
+        for uci in moves.split():
+            position.make_move(uci_to_move(position, uci))
+        if position.get_fen() != expected:
+            failures += 1
+        print("{} {}: {} {}".format(fen, moves, position.get_fen(),
+                                    "OK" if position.get_fen() == expected else "FAIL, expected {}".format(expected)))
+
+    elapsed = time.time() - start_time
+    print("{} nodes in {:0.2f}s, {} failures".format(total_nodes, elapsed, failures))
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the leaf nodes of the legal move tree")
+    parser.add_argument('depth', type=int, nargs='?', help="depth of the move tree")
+    parser.add_argument('--fen', default=starting_fen, help="position to count from")
+    parser.add_argument('--divide', action='store_true', help="show the node count below each root move")
+    parser.add_argument('--hash', action='store_true', help="store node counts of subtrees in a hash table")
+    parser.add_argument('--suite', action='store_true', help="check the node counts of the standard positions")
+    parser.add_argument('--max-nodes', type=int, default=100000,
+                        help="largest node count checked by the suite (default: %(default)s)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of worker processes, or 0 to use all cores (default: %(default)s)")
+    parser.add_argument('--split', type=int, default=1, choices=(1, 2),
+                        help="plies from the root at which the tree is split between workers (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.suite:
+        sys.exit(1 if run_suite(args.max_nodes, args.hash, args.jobs) else 0)
+
+    if args.depth is None:
+        parser.error("a depth is required unless --suite is given")
+
+    position = Position(args.fen)
+    tt = {} if args.hash else None
+    start_time = time.time()
+
+    if args.jobs != 1:
+        with perft_pool(args.jobs or None, args.hash) as pool:
+            results = parallel_perft(args.fen, args.depth, pool, args.split)
+
+        # Subtrees are shown grouped by root move, with the time each took in its worker
+        if args.divide:
+            root_moves = {}
+            for moves, node_count, elapsed in results:
+                if moves:
+                    total_count, total_elapsed = root_moves.get(moves[0], (0, 0))
+                    root_moves[moves[0]] = (total_count + node_count, total_elapsed + elapsed)
+            for move, (node_count, elapsed) in root_moves.items():
+                print("{}: {} ({:0.2f}s)".format(move_to_uci(move), node_count, elapsed))
+            print()
+        node_count = sum(result[1] for result in results)
+    elif args.divide:
+        results = divide(position, args.depth, tt)
+        for move, node_count in results:
+            print("{}: {}".format(move_to_uci(move), node_count))
+        node_count = sum(node_count for _, node_count in results)
+        print()
+    else:
+        node_count = perft(position, args.depth, tt)
+
+    elapsed = time.time() - start_time
+    print("Nodes: {}".format(node_count))
+    print("Time taken: {:0.2f}s".format(elapsed))
+    print("Nodes per second: {:0.0f}".format(node_count / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,183 +1,212 @@
-from collections import deque
 from gmpy2 import bit_scan1, popcount
 
-from common import (flip_vertical, piece_string_to_int, pawn_shift, gen_bitboard_indices,
-                    bb_between, san_to_index, index_to_san, piece_int_to_string, pawn_push)
+from common import (pawn_shift, bitboard_indices,
+                    bb_between, bb_line, san_to_index, index_to_san, piece_int_to_string,
+                    piece_string_to_int, pawn_push)
 from consts import (B_BISHOP, B_KING, B_KNIGHT, B_PAWN, B_QUEEN, B_ROOK, COLOURS, WHITE, BLACK, KING,
                     W_BISHOP, W_KING, W_KNIGHT, W_PAWN, W_QUEEN, W_ROOK, NO_PIECE, PIECES, PIECE_TYPES,
                     ROOK, PAWN, PROMOTION, CASTLING, ZOBRIST_BOARD, ZOBRIST_CASTLING, ZOBRIST_COLOUR,
                     KINGSIDE, QUEENSIDE, NO_CASTLING, W_KINGSIDE, W_QUEENSIDE, B_KINGSIDE, B_QUEENSIDE,
                     MATERIAL, MIDGAME, ENDGAME, KNIGHT, BISHOP, QUEEN, ALL, RANK_2_BB, RANK_4_BB,
-                    RANK_5_BB, RANK_7_BB, NORTH, CAPTURES, NORMAL, ZOBRIST_ENPASSANT, EN_PASSANT,
-                    ALL_PIECES, RANK_1, RANK_8)
+                    RANK_5_BB, RANK_7_BB, NORTH, CAPTURES, QUIETS, QUIET_CHECKS, EVASIONS, NORMAL,
+                    ZOBRIST_ENPASSANT, EN_PASSANT, ALL_PIECES, RANK_1, RANK_8, RANK_1_BB, RANK_8_BB,
+                    A_FILE_BB, H_FILE_BB, _64BITS, NON_PAWN_MATERIAL, PHASE_WEIGHT)
 from movegen import (get_pawn_moves, get_knight_moves, get_bishop_moves, get_rook_moves, get_queen_moves,
                      get_king_moves, generate_promotions)
-from attack_tables import pawn_attacks, pseudo_attacks, bishop_masks, rook_masks, batk_table, ratk_table
+from moves import src_of, dst_of, type_of, promotion_of
+from attack_tables import pawn_attacks, pseudo_attacks, bishop_attacks, rook_attacks, queen_attacks
 from eval_tables import psq_table
 
 
-class Position:
-    def __init__(self, fen):
-        [fen_board, fen_colour, fen_castling_rights, fen_ep_target, fen_halfmove_clock,
-         fen_fullmove_number] = fen.split(' ')
+# State needed to undo a move, reused across calls to make_move
+class UndoInfo:
+    __slots__ = ('move', 'captured', 'zobrist', 'pawn_key', 'material_key', 'ep_square',
+                 'castling_rights', 'halfmove_clock', 'check_info', 'attack_info')
 
-        # Set colour of current player
-        self.colour = WHITE if fen_colour == 'w' else BLACK
 
-        # Set castling rights of current position
-        self.castling_rights = NO_CASTLING
-        if 'K' in fen_castling_rights:
-            self.castling_rights += W_KINGSIDE
-        if 'Q' in fen_castling_rights:
-            self.castling_rights += W_QUEENSIDE
-        if 'k' in fen_castling_rights:
-            self.castling_rights += B_KINGSIDE
-        if 'q' in fen_castling_rights:
-            self.castling_rights += B_QUEENSIDE
+# Used for converting castling rights from letters to numbers
+castling_string_to_int = {'K': W_KINGSIDE,
+                          'Q': W_QUEENSIDE,
+                          'k': B_KINGSIDE,
+                          'q': B_QUEENSIDE}
 
-        # Set en passant target of current position
-        if fen_ep_target == '-':
-            self.ep_square = None
-        else:
-            self.ep_square = san_to_index[fen_ep_target]
 
-        # Set halfmove clock and fullmove number of current position
-        self.halfmove_clock = int(fen_halfmove_clock)
-        self.fullmove_number = int(fen_fullmove_number)
+# Check and pin information for a position, computed at most once per position
+class CheckInfo:
+    # checkers: pieces giving check to the side to move
+    # blockers: indexed by colour, pieces of either colour which are the only blocker
+    #           between an enemy slider and the king of that colour
+    # check_squares: indexed by piece type, squares from which the side to move would give check
+    __slots__ = ('checkers', 'blockers', 'check_squares')
 
-        self.squares = None
 
-        # Initialise bitboards for piece, colour, and overall occupancy
-        self.occupancy = 0
-        self.player_occ = [0 for _ in range(2)]
-        self.piece_bb = [None for _ in range(15)]
-        for piece in PIECES:
-            self.piece_bb[piece] = 0
+# Attacks of every piece on the board, computed at most once per position
+class AttackInfo:
+    # attacks: indexed by square, squares attacked by the piece on that square (except pawns)
+    # attacked_by: indexed by colour, then by piece type, squares attacked by those pieces
+    #              Index ALL_PIECES holds the squares attacked by any piece of that colour
+    __slots__ = ('attacks', 'attacked_by')
 
-        self.zobrist = None
-        self.pawn_key = None
-        self.material_key = None
 
-        self.init_bitboards_from_fen(fen_board)
-        self.init_squares_from_fen(fen_board)
-        self.init_zobrist()
+class Position:
+    # Move generation functions, indexed by piece type
+    get_moves_for_piece = [None, get_pawn_moves, get_knight_moves, get_bishop_moves, get_rook_moves,
+                           get_queen_moves, get_king_moves]
 
-        # Initialise stacks for undoing moves and detecting repetitions
-        self.undo_info = deque()
-        self.repetition_stack = []
+    # Sets up the position from a 'FEN' string, then makes the given moves from it, where 0 is a null move
+    def __init__(self, fen, moves=()):
+        # Undo records are only allocated once, then reused by later moves at the same ply
+        self.undo_stack = []
 
-        self.is_endgame = False
-        self.psq_score_mg = [0, 0]
-        self.psq_score_eg = [0, 0]
+        self.set_fen(fen)
 
-        self.init_psq_score()
+        for move in moves:
+            if move:
+                self.make_move(move)
+            else:
+                self.make_null_move()
+
+    # Positions are pickled and copied as the starting 'FEN' string and the moves made from it, which do
+    # not depend on the zobrist keys or on the attributes of the class
+    def __getstate__(self):
+        return self.get_game()
+
+    def __setstate__(self, state):
+        # Positions pickled before games were stored this way keep all of their attributes
+        if isinstance(state, dict):
+            state = game_from_old_state(state)
+        self.__init__(*state)
+
+    # Returns the starting position as a 'FEN' string, along with the list of moves made from it
+    def get_game(self):
+        moves = self.move_history()
+        for move in reversed(moves):
+            if move:
+                self.undo_move()
+            else:
+                self.undo_null_move()
 
-        self.get_moves_for_piece = [None for _ in range(7)]
-        self.get_moves_for_piece[PAWN] = get_pawn_moves
-        self.get_moves_for_piece[KNIGHT] = get_knight_moves
-        self.get_moves_for_piece[BISHOP] = get_bishop_moves
-        self.get_moves_for_piece[ROOK] = get_rook_moves
-        self.get_moves_for_piece[QUEEN] = get_queen_moves
-        self.get_moves_for_piece[KING] = get_king_moves
+        fen = self.get_fen()
 
-    # Parse 'FEN' string to initialise bitboard values
-    def init_bitboards_from_fen(self, board_fen):
-        index = 0
-        
-        for char in board_fen:
-            if char in 'KQRBNPkqrbnp':
-                mask = 1 << index
-                if char == 'K':
-                    self.piece_bb[W_KING] |= mask
-                elif char == 'Q':
-                    self.piece_bb[W_QUEEN] |= mask
-                elif char == 'R':
-                    self.piece_bb[W_ROOK] |= mask
-                elif char == 'B':
-                    self.piece_bb[W_BISHOP] |= mask
-                elif char == 'N':
-                    self.piece_bb[W_KNIGHT] |= mask
-                elif char == 'P':
-                    self.piece_bb[W_PAWN] |= mask
-                elif char == 'k':
-                    self.piece_bb[B_KING] |= mask
-                elif char == 'q':
-                    self.piece_bb[B_QUEEN] |= mask
-                elif char == 'r':
-                    self.piece_bb[B_ROOK] |= mask
-                elif char == 'b':
-                    self.piece_bb[B_BISHOP] |= mask
-                elif char == 'n':
-                    self.piece_bb[B_KNIGHT] |= mask
-                elif char == 'p':
-                    self.piece_bb[B_PAWN] |= mask
-                index += 1
-            elif char in '12345678':
-                index += int(char)
-            elif char == '/':
-                pass
+        for move in moves:
+            if move:
+                self.make_move(move)
             else:
-                raise Exception("Unknown character in FEN: {}".format(char))
+                self.make_null_move()
 
-        for piece in PIECES:
-            self.piece_bb[piece] = flip_vertical(self.piece_bb[piece])
+        return fen, moves
 
-        for colour in COLOURS:
-            for piece_type in PIECE_TYPES:
-                self.player_occ[colour] |= self.piece_bb[(colour << 3) | piece_type]
+    # Sets up the position from a 'FEN' string, reusing this object and starting an empty game history
+    # EPD records are also accepted, where the halfmove clock and fullmove number are replaced by
+    # operations such as 'bm e5; id "x";'. The clocks are read from 'hmvc' and 'fmvn' operations if present
+    def set_fen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise Exception("Invalid FEN: {}".format(fen))
+        fen_board, fen_colour, fen_castling_rights, fen_ep_target = fields[:4]
 
-        self.occupancy = self.player_occ[WHITE] | self.player_occ[BLACK]
+        # Set colour of current player
+        self.colour = WHITE if fen_colour == 'w' else BLACK
+
+        # Set castling rights of current position
+        self.castling_rights = NO_CASTLING
+        if fen_castling_rights != '-':
+            for char in fen_castling_rights:
+                self.castling_rights |= castling_string_to_int[char]
 
-    # Parse 'FEN' string to initialise list values
-    def init_squares_from_fen(self, board_fen):
-        self.squares = [None] * 64
+        # Set en passant target of current position
+        if fen_ep_target == '-':
+            self.ep_square = None
+        else:
+            self.ep_square = san_to_index[fen_ep_target]
 
+        # Set halfmove clock and fullmove number of current position
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+            self.halfmove_clock = int(fields[4])
+            self.fullmove_number = int(fields[5])
+            operations = fields[6:]
+        else:
+            operations = fields[4:]
+
+        for operation in ' '.join(operations).split(';'):
+            operation = operation.split()
+            if len(operation) == 2 and operation[1].isdigit():
+                if operation[0] == 'hmvc':
+                    self.halfmove_clock = int(operation[1])
+                elif operation[0] == 'fmvn':
+                    self.fullmove_number = int(operation[1])
+
+        # Parse the board in a single pass, starting from the a8 square
+        piece_bb = [0 for _ in range(15)]
         index = 0
-        for char in board_fen:
-            if char in 'KQRBNPkqrbnp':
-                self.squares[index ^ 56] = piece_string_to_int[char]
+        for char in fen_board:
+            if char in piece_string_to_int:
+                piece_bb[piece_string_to_int[char]] |= 1 << (index ^ 56)
                 index += 1
             elif char in '12345678':
-                for _ in range(int(char)):
-                    self.squares[index ^ 56] = NO_PIECE
-                    index += 1
-            elif char == '/':
-                pass
-            else:
+                index += ord(char) - 48
+            elif char != '/':
                 raise Exception("Unknown character in FEN: {}".format(char))
 
-    def init_zobrist(self):
-        self.zobrist = 0
+        self.piece_bb = piece_bb
+        self.init_from_bitboards()
+
+    # Initialises everything derived from the piece bitboards, and starts an empty game history
+    def init_from_bitboards(self):
+        self.player_occ = [0 for _ in range(2)]
+        self.squares = [NO_PIECE] * 64
+        self.zobrist = ZOBRIST_CASTLING[self.castling_rights]
+        if self.colour == BLACK:
+            self.zobrist ^= ZOBRIST_COLOUR
+        if self.ep_square is not None:
+            self.zobrist ^= ZOBRIST_ENPASSANT[self.ep_square & 7]
         self.pawn_key = 0
         self.material_key = 0
+        self.psq_score_mg = [0, 0]
+        self.psq_score_eg = [0, 0]
+        self.piece_count = [0 for _ in range(15)]
+        self.non_pawn_material = [0, 0]
+        self.game_phase = 0
 
-        for sq in range(64):
-            piece = self.squares[sq]
-            if piece:
-                self.zobrist ^= ZOBRIST_BOARD[piece][sq]
-                if piece & 7 == PAWN:
-                    self.pawn_key ^= ZOBRIST_BOARD[piece][sq]
-
+        # Initialise colour occupancies, square-centric representation, keys, piece-square scores and material
         for piece in PIECES:
-            for count in range(popcount(self.piece_bb[piece])):
-                self.material_key ^= ZOBRIST_BOARD[piece][count]
-
-        if self.castling_rights & W_KINGSIDE:
-            self.zobrist ^= ZOBRIST_CASTLING[W_KINGSIDE]
-        if self.castling_rights & W_QUEENSIDE:
-            self.zobrist ^= ZOBRIST_CASTLING[W_QUEENSIDE]
-        if self.castling_rights & B_KINGSIDE:
-            self.zobrist ^= ZOBRIST_CASTLING[B_KINGSIDE]
-        if self.castling_rights & B_QUEENSIDE:
-            self.zobrist ^= ZOBRIST_CASTLING[B_QUEENSIDE]
-
-    def init_psq_score(self):
-        for sq in range(64):
-            piece = self.squares[sq]
-            if piece:
-                colour = piece >> 3
-                self.psq_score_mg[colour] += psq_table[piece][sq][MIDGAME]
-                self.psq_score_eg[colour] += psq_table[piece][sq][ENDGAME]
+            colour = piece >> 3
+            piece_zobrist = ZOBRIST_BOARD[piece]
+            piece_psq = psq_table[piece]
+            is_pawn = piece & 7 == PAWN
+            bb = self.piece_bb[piece]
+            self.player_occ[colour] |= bb
+
+            count = 0
+            while bb:
+                sq = bit_scan1(bb)
+                self.squares[sq] = piece
+                self.zobrist ^= piece_zobrist[sq]
+                if is_pawn:
+                    self.pawn_key ^= piece_zobrist[sq]
+                self.material_key ^= piece_zobrist[count]
+                self.psq_score_mg[colour] += piece_psq[sq][MIDGAME]
+                self.psq_score_eg[colour] += piece_psq[sq][ENDGAME]
+                count += 1
+                bb &= bb - 1
+
+            self.piece_count[piece] = count
+            self.non_pawn_material[colour] += NON_PAWN_MATERIAL[piece & 7] * count
+            self.game_phase += PHASE_WEIGHT[piece & 7] * count
+
+        self.occupancy = self.player_occ[WHITE] | self.player_occ[BLACK]
+
+        # Initialise stacks for undoing moves and detecting repetitions
+        self.ply = 0
+        self.repetition_stack = []
+
+        # Computed lazily by get_check_info and get_attack_info
+        self.check_info = None
+        self.attack_info = None
+
+        self.is_endgame = False
 
     def update_bitboards(self, src_piece, dst_piece, src_index, dst_index, captured):
         src_bb = 1 << src_index
@@ -196,30 +225,57 @@ class Position:
         else:
             self.occupancy ^= move_bb
 
+    # Gets the undo record for the current ply, allocating one if this ply has not been reached before
+    def push_undo_info(self):
+        if self.ply == len(self.undo_stack):
+            self.undo_stack.append(UndoInfo())
+        undo = self.undo_stack[self.ply]
+        self.ply += 1
+        return undo
+
+    # Returns the most recently made move (0 for a null move), or None if no moves have been made
+    def last_move(self):
+        if self.ply:
+            return self.undo_stack[self.ply - 1].move
+        return None
+
+    # Returns the list of moves made from the initial position
+    def move_history(self):
+        return [self.undo_stack[i].move for i in range(self.ply)]
+
     def make_move(self, move):
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
-        move_type = move & (0x3 << 14)
+        src_index = src_of[move]
+        dst_index = dst_of[move]
+        move_type = type_of[move]
 
         src_piece = self.squares[src_index]
         captured = self.squares[dst_index]
 
-        self.undo_info.append({'move': move,
-                               'captured': captured,
-                               'zobrist': self.zobrist,
-                               'pawn key': self.pawn_key,
-                               'material key': self.material_key,
-                               'en passant': self.ep_square,
-                               'castling': self.castling_rights,
-                               'halfmove clock': self.halfmove_clock})
-
+        undo = self.push_undo_info()
+        undo.move = move
+        undo.captured = captured
+        undo.zobrist = self.zobrist
+        undo.pawn_key = self.pawn_key
+        undo.material_key = self.material_key
+        undo.ep_square = self.ep_square
+        undo.castling_rights = self.castling_rights
+        undo.halfmove_clock = self.halfmove_clock
+        undo.check_info = self.check_info
+        undo.attack_info = self.attack_info
+
+        self.check_info = None
+        self.attack_info = None
         self.halfmove_clock += 1
 
         if move_type == PROMOTION:
-            dst_piece_type = ((move >> 12) & 0x3) + 2
+            dst_piece_type = promotion_of[move]
             dst_piece = (self.colour << 3) | dst_piece_type
-            self.material_key ^= ZOBRIST_BOARD[src_piece][popcount(self.piece_bb[src_piece]) - 1]
-            self.material_key ^= ZOBRIST_BOARD[dst_piece][popcount(self.piece_bb[dst_piece])]
+            self.piece_count[src_piece] -= 1
+            self.material_key ^= ZOBRIST_BOARD[src_piece][self.piece_count[src_piece]]
+            self.material_key ^= ZOBRIST_BOARD[dst_piece][self.piece_count[dst_piece]]
+            self.piece_count[dst_piece] += 1
+            self.non_pawn_material[self.colour] += NON_PAWN_MATERIAL[dst_piece_type]
+            self.game_phase += PHASE_WEIGHT[dst_piece_type]
         else:
             dst_piece = src_piece
 
@@ -252,7 +308,10 @@ class Position:
         self.zobrist ^= ZOBRIST_BOARD[src_piece][src_index]  # Remove piece from start square
         if captured:
             self.zobrist ^= ZOBRIST_BOARD[captured][dst_index]  # Remove captured piece
-            self.material_key ^= ZOBRIST_BOARD[captured][popcount(self.piece_bb[captured]) - 1]
+            self.piece_count[captured] -= 1
+            self.material_key ^= ZOBRIST_BOARD[captured][self.piece_count[captured]]
+            self.non_pawn_material[self.colour ^ 1] -= NON_PAWN_MATERIAL[captured & 7]
+            self.game_phase -= PHASE_WEIGHT[captured & 7]
             self.psq_score_mg[self.colour ^ 1] -= psq_table[captured][dst_index][MIDGAME]
             self.psq_score_eg[self.colour ^ 1] -= psq_table[captured][dst_index][ENDGAME]
             self.halfmove_clock = 0  # Reset halfmove clock on captures
@@ -282,7 +341,8 @@ class Position:
 
                 # Update zobrist for en passant captured piece
                 self.zobrist ^= ZOBRIST_BOARD[ep_captured_piece][ep_capture_index]
-                self.material_key ^= ZOBRIST_BOARD[ep_captured_piece][popcount(self.piece_bb[ep_captured_piece]) - 1]
+                self.piece_count[ep_captured_piece] -= 1
+                self.material_key ^= ZOBRIST_BOARD[ep_captured_piece][self.piece_count[ep_captured_piece]]
 
                 self.psq_score_mg[self.colour ^ 1] -= psq_table[ep_captured_piece][ep_capture_index][MIDGAME]
                 self.psq_score_eg[self.colour ^ 1] -= psq_table[ep_captured_piece][ep_capture_index][ENDGAME]
@@ -332,6 +392,10 @@ class Position:
             self.psq_score_eg[self.colour] -= psq_table[(self.colour << 3) | ROOK][rook_src][ENDGAME]
             self.psq_score_eg[self.colour] += psq_table[(self.colour << 3) | ROOK][rook_dst][ENDGAME]
 
+        # The fullmove number is incremented after each move by black
+        if self.colour == BLACK:
+            self.fullmove_number += 1
+
         # Toggle colour
         self.colour ^= 1
 
@@ -340,26 +404,36 @@ class Position:
     def undo_move(self):
         # Toggle colour
         self.colour ^= 1
-        
-        prev_state_info = self.undo_info.pop()        
 
-        move = prev_state_info['move']
-        captured = prev_state_info['captured']
-        self.zobrist = prev_state_info['zobrist']
-        self.pawn_key = prev_state_info['pawn key']
-        self.material_key = prev_state_info['material key']
-        self.ep_square = prev_state_info['en passant']
-        self.castling_rights = prev_state_info['castling']
-        self.halfmove_clock = prev_state_info['halfmove clock']
+        if self.colour == BLACK:
+            self.fullmove_number -= 1
+
+        self.ply -= 1
+        undo = self.undo_stack[self.ply]
+
+        move = undo.move
+        captured = undo.captured
+        self.zobrist = undo.zobrist
+        self.pawn_key = undo.pawn_key
+        self.material_key = undo.material_key
+        self.ep_square = undo.ep_square
+        self.castling_rights = undo.castling_rights
+        self.halfmove_clock = undo.halfmove_clock
+        self.check_info = undo.check_info
+        self.attack_info = undo.attack_info
 
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
-        move_type = move & (0x3 << 14)
+        src_index = src_of[move]
+        dst_index = dst_of[move]
+        move_type = type_of[move]
 
         dst_piece = self.squares[dst_index]
         
         if move_type == PROMOTION:
             src_piece = (self.colour << 3) | PAWN
+            self.piece_count[src_piece] += 1
+            self.piece_count[dst_piece] -= 1
+            self.non_pawn_material[self.colour] -= NON_PAWN_MATERIAL[dst_piece & 7]
+            self.game_phase -= PHASE_WEIGHT[dst_piece & 7]
         else:
             src_piece = dst_piece
 
@@ -373,6 +447,9 @@ class Position:
         if captured:
             self.psq_score_mg[self.colour ^ 1] += psq_table[captured][dst_index][MIDGAME]
             self.psq_score_eg[self.colour ^ 1] += psq_table[captured][dst_index][ENDGAME]
+            self.piece_count[captured] += 1
+            self.non_pawn_material[self.colour ^ 1] += NON_PAWN_MATERIAL[captured & 7]
+            self.game_phase += PHASE_WEIGHT[captured & 7]
 
         self.update_bitboards(src_piece, dst_piece, src_index, dst_index, captured)
 
@@ -401,6 +478,7 @@ class Position:
 
             # Add en passant captured piece to the square-centric board
             self.squares[ep_capture_index] = ep_captured_piece
+            self.piece_count[ep_captured_piece] += 1
 
             # Update bitboards for the en passant captured piece
             self.piece_bb[ep_captured_piece] ^= ep_capture_bb
@@ -413,12 +491,16 @@ class Position:
         self.repetition_stack.pop()
 
     def make_null_move(self):
-        self.undo_info.append({'move': 0,
-                               'captured': 0,
-                               'zobrist': self.zobrist,
-                               'en passant': self.ep_square,
-                               'castling': self.castling_rights,
-                               'halfmove clock': self.halfmove_clock})
+        undo = self.push_undo_info()
+        undo.move = 0
+        undo.captured = 0
+        undo.zobrist = self.zobrist
+        undo.ep_square = self.ep_square
+        undo.halfmove_clock = self.halfmove_clock
+        undo.check_info = self.check_info
+
+        # Attacks do not depend on the side to move, so the attack information is kept
+        self.check_info = None
 
         # Reset en passant square and zobrist
         if self.ep_square:
@@ -438,69 +520,64 @@ class Position:
         # Toggle colour
         self.colour ^= 1
 
-        prev_state_info = self.undo_info.pop()
+        self.ply -= 1
+        undo = self.undo_stack[self.ply]
 
         # Restore the attributes that may have been changed by a null move
-        self.zobrist = prev_state_info['zobrist']
-        self.ep_square = prev_state_info['en passant']
-        self.halfmove_clock = prev_state_info['halfmove clock']
+        self.zobrist = undo.zobrist
+        self.ep_square = undo.ep_square
+        self.halfmove_clock = undo.halfmove_clock
+        self.check_info = undo.check_info
 
         self.repetition_stack.pop()
 
-    def generate_castling(self, colour, move_list):
+    # Castling moves are only generated if the destination square of the king is a target square
+    def generate_castling(self, colour, move_list, targets=_64BITS):
         if colour == WHITE:
-            if self.castling_rights & W_KINGSIDE:
+            if self.castling_rights & W_KINGSIDE and targets & 0x40:
                 if not self.occupancy & 0x60:
                     if not self.is_square_attacked(4) and not self.is_square_attacked(5) and not self.is_square_attacked(6):
                         move_list.append(CASTLING + (4 << 6) + 6)
-            if self.castling_rights & W_QUEENSIDE:
+            if self.castling_rights & W_QUEENSIDE and targets & 0x4:
                 if not self.occupancy & 0xe:
                     if not self.is_square_attacked(2) and not self.is_square_attacked(3) and not self.is_square_attacked(4):
                         move_list.append(CASTLING + (4 << 6) + 2)
         else:
-            if self.castling_rights & B_KINGSIDE:
+            if self.castling_rights & B_KINGSIDE and targets & 0x4000000000000000:
                 if not self.occupancy & 0x6000000000000000:
                     if not self.is_square_attacked(60) and not self.is_square_attacked(61) and not self.is_square_attacked(62):
                         move_list.append(CASTLING + (60 << 6) + 62)
-            if self.castling_rights & B_QUEENSIDE:
+            if self.castling_rights & B_QUEENSIDE and targets & 0x400000000000000:
                 if not self.occupancy & 0xe00000000000000:
                     if not self.is_square_attacked(58) and not self.is_square_attacked(59) and not self.is_square_attacked(60):
                         move_list.append(CASTLING + (60 << 6) + 58)
 
-    def get_check_evasions(self, colour):
-        move_list = deque()
+    # Move generators fill the given move list, which is cleared first, so that
+    # the search can reuse one list per ply. A new list is used if none is given
+    # Only evasions to the target squares are generated
+    def get_check_evasions(self, colour, move_list=None, targets=_64BITS):
+        if move_list is None:
+            move_list = []
+        else:
+            move_list.clear()
         
         occ = self.occupancy
         king_sqr = bit_scan1(self.piece_bb[((colour << 3) | KING)])
 
         # Try moving king
-        moves = pseudo_attacks[KING][king_sqr] & ~self.player_occ[colour]
-        for sq in gen_bitboard_indices(moves):
+        moves = pseudo_attacks[KING][king_sqr] & ~self.player_occ[colour] & targets
+        for sq in bitboard_indices(moves):
             if not self.is_square_attacked(sq, occ ^ (1 << king_sqr)):
                 move_list.append((king_sqr << 6) + sq)
 
-        attackers = self.attacks_to(king_sqr, colour ^ 1, occ)
+        check_info = self.get_check_info()
+        attackers = check_info.checkers
 
         # If in double check, only evasions are through king moves
         if attackers & (attackers - 1):
             return move_list
 
-        enemy_colour = colour ^ 1
-        enemy_rooks = self.piece_bb[((enemy_colour << 3) | ROOK)]
-        enemy_bishops = self.piece_bb[((enemy_colour << 3) | BISHOP)]
-        enemy_queens = self.piece_bb[((enemy_colour << 3) | QUEEN)]
-
-        sliders = ((pseudo_attacks[ROOK][king_sqr] & (enemy_rooks | enemy_queens))
-                   | (pseudo_attacks[BISHOP][king_sqr] & (enemy_bishops | enemy_queens)))
-
-        pinned = 0
-        while sliders:
-            slider_sqr = bit_scan1(sliders)
-            sqrs_between = bb_between[king_sqr][slider_sqr]
-            blockers = sqrs_between & occ
-            if not blockers & (blockers - 1):
-                pinned |= blockers
-            sliders &= sliders - 1
+        pinned = check_info.blockers[colour] & self.player_occ[colour]
 
         attacker_sqr = bit_scan1(attackers)
         attacker_piece = self.squares[attacker_sqr] & 7
@@ -513,13 +590,16 @@ class Position:
         queens = self.piece_bb[colour_mask | QUEEN]
 
         # Try capturing attacker piece
-        defenders = pawn_attacks[colour ^ 1][attacker_sqr] & pawns
-        defenders |= pseudo_attacks[KNIGHT][attacker_sqr] & knights
-        defenders |= ratk_table[attacker_sqr][occ & rook_masks[attacker_sqr]] & (rooks | queens)
-        defenders |= batk_table[attacker_sqr][occ & bishop_masks[attacker_sqr]] & (bishops | queens)
-        defenders &= ~pinned
+        if (1 << attacker_sqr) & targets:
+            defenders = pawn_attacks[colour ^ 1][attacker_sqr] & pawns
+            defenders |= pseudo_attacks[KNIGHT][attacker_sqr] & knights
+            defenders |= rook_attacks(attacker_sqr, occ) & (rooks | queens)
+            defenders |= bishop_attacks(attacker_sqr, occ) & (bishops | queens)
+            defenders &= ~pinned
+        else:
+            defenders = 0
 
-        for defender_sq in gen_bitboard_indices(defenders):
+        for defender_sq in bitboard_indices(defenders):
             if self.squares[defender_sq] & 7 == PAWN and attacker_sqr >> 3 == (RANK_8 if colour == WHITE else RANK_1):
                 generate_promotions(defender_sq, attacker_sqr, move_list)
             else:
@@ -527,72 +607,180 @@ class Position:
 
         # Try blocking attack by slider piece
         if attacker_piece == BISHOP or attacker_piece == ROOK or attacker_piece == QUEEN:
-            sqrs_between = bb_between[king_sqr][attacker_sqr]
+            sqrs_between = bb_between[king_sqr][attacker_sqr] & targets
 
-            for sq in gen_bitboard_indices(sqrs_between):
+            for sq in bitboard_indices(sqrs_between):
                 one_step = pawn_shift[colour ^ 1](1 << sq, NORTH)
                 blockers = one_step & pawns
                 blockers |= ((RANK_2_BB if colour == WHITE else RANK_7_BB)
                              & pawn_shift[colour ^ 1](one_step & ~occ, NORTH) & pawns)
                 blockers |= pseudo_attacks[KNIGHT][sq] & knights
-                blockers |= ratk_table[sq][occ & rook_masks[sq]] & (rooks | queens)
-                blockers |= batk_table[sq][occ & bishop_masks[sq]] & (bishops | queens)
+                blockers |= rook_attacks(sq, occ) & (rooks | queens)
+                blockers |= bishop_attacks(sq, occ) & (bishops | queens)
                 blockers &= ~pinned
                 
-                for blocker_sq in gen_bitboard_indices(blockers):
-                    if self.squares[blocker_sq] & 7 == PAWN and attacker_sqr >> 3 == (RANK_8 if colour == WHITE else RANK_1):
+                for blocker_sq in bitboard_indices(blockers):
+                    if self.squares[blocker_sq] & 7 == PAWN and sq >> 3 == (RANK_8 if colour == WHITE else RANK_1):
                         generate_promotions(blocker_sq, sq, move_list)
                     else:
                         move_list.append((blocker_sq << 6) + sq)
 
-        if self.ep_square:
+        if self.ep_square and (1 << self.ep_square) & targets:
             ep_attackers = pawn_attacks[colour ^ 1][self.ep_square] & pawns
             if ep_attackers:
-                for sq in gen_bitboard_indices(ep_attackers):
+                for sq in bitboard_indices(ep_attackers):
                     ep_move = EN_PASSANT + (sq << 6) + self.ep_square
-                    self.make_move(ep_move)
-                    in_check = self.is_in_check(colour)
-                    self.undo_move()
-                    if not in_check:
+                    if self.is_legal_en_passant(ep_move):
                         move_list.append(ep_move)
         
         return move_list
         
-    def get_pseudo_legal_moves(self, gen_type=ALL):        
-        move_list = deque()
+    # Moves are only generated to the target squares, so that callers can restrict generation to
+    # a set of squares, such as captures of a single piece
+    def get_pseudo_legal_moves(self, gen_type=ALL, move_list=None, targets=_64BITS):
+        if move_list is None:
+            move_list = []
+        else:
+            move_list.clear()
 
-        player_pawns = self.piece_bb[(self.colour << 3) | PAWN]
+        if gen_type == QUIET_CHECKS:
+            return self.get_quiet_checks(move_list, targets)
 
-        self.get_moves_for_piece[PAWN](player_pawns, self.colour, gen_type, self.occupancy, self.player_occ, move_list)
+        colour = self.colour
+        occ = self.occupancy
+        enemy_occ = self.player_occ[colour ^ 1]
+        player_pawns = self.piece_bb[(colour << 3) | PAWN]
 
-        occ_without_pawns = self.player_occ[self.colour] & ~player_pawns
+        self.get_moves_for_piece[PAWN](player_pawns, colour, gen_type, occ, enemy_occ, targets, move_list)
 
-        for sq in gen_bitboard_indices(occ_without_pawns):
-            piece = self.squares[sq]
-            piece_type = piece & 7
-            
-            self.get_moves_for_piece[piece_type](sq, self.colour, gen_type, self.occupancy, self.player_occ, move_list)
+        if gen_type == CAPTURES:
+            piece_targets = enemy_occ & targets
+        elif gen_type == QUIETS:
+            piece_targets = ~occ & targets
+        else:
+            piece_targets = ~self.player_occ[colour] & targets
 
-        if self.ep_square:
-            ep_attackers = pawn_attacks[self.colour ^ 1][self.ep_square] & player_pawns
+        occ_without_pawns = self.player_occ[colour] & ~player_pawns
+
+        for sq in bitboard_indices(occ_without_pawns):
+            self.get_moves_for_piece[self.squares[sq] & 7](sq, occ, piece_targets, move_list)
+
+        # En passant captures are generated with captures only, so that they are not generated twice
+        # when captures and quiet moves are generated separately
+        if self.ep_square and gen_type != QUIETS and (1 << self.ep_square) & targets:
+            ep_attackers = pawn_attacks[colour ^ 1][self.ep_square] & player_pawns
             if ep_attackers:
-                for sq in gen_bitboard_indices(ep_attackers):
+                for sq in bitboard_indices(ep_attackers):
                     move_list.append(EN_PASSANT + (sq << 6) + self.ep_square)
 
         if gen_type != CAPTURES:
-            self.generate_castling(self.colour, move_list)
+            self.generate_castling(colour, move_list, targets)
 
         return move_list
 
-    def is_pseudo_legal(self, move):
-        move_type = move & (0x3 << 14)
-        if move_type != NORMAL:
-            return move in self.get_pseudo_legal_moves()
+    # Generates non-capturing moves which give check, apart from promotions and castling
+    # A piece gives a direct check by moving to one of its check squares, and a piece blocking one of its
+    # own sliders from the enemy king gives a discovered check by moving off the line to the king
+    def get_quiet_checks(self, move_list, targets=_64BITS):
+        colour = self.colour
+        occ = self.occupancy
+        check_info = self.get_check_info()
+        check_squares = check_info.check_squares
+        enemy_king_sqr = bit_scan1(self.piece_bb[((colour ^ 1) << 3) | KING])
+        discoverers = check_info.blockers[colour ^ 1] & self.player_occ[colour]
+        targets &= ~occ
+
+        # Pawns which promote by pushing are left out, as underpromotions are not quiet checks
+        player_pawns = self.piece_bb[(colour << 3) | PAWN] & ~(RANK_7_BB if colour == WHITE else RANK_2_BB)
+        get_pawn_moves(player_pawns & ~discoverers, colour, QUIETS, occ, 0, check_squares[PAWN] & targets,
+                       move_list)
+        for sq in bitboard_indices(player_pawns & discoverers):
+            get_pawn_moves(1 << sq, colour, QUIETS, occ, 0,
+                           (check_squares[PAWN] | ~bb_line[enemy_king_sqr][sq]) & targets, move_list)
+
+        for sq in bitboard_indices(self.player_occ[colour] & ~self.piece_bb[(colour << 3) | PAWN]):
+            piece_type = self.squares[sq] & 7
+            if (1 << sq) & discoverers:
+                piece_targets = (check_squares[piece_type] | ~bb_line[enemy_king_sqr][sq]) & targets
+            else:
+                piece_targets = check_squares[piece_type] & targets
+            if piece_targets:
+                self.get_moves_for_piece[piece_type](sq, occ, piece_targets, move_list)
+
+        return move_list
 
+    # Generates legal moves only. When in check, the check evasions of the given gen_type are returned,
+    # and asking for evasions when not in check generates all legal moves
+    def get_legal_moves(self, gen_type=ALL, move_list=None, targets=_64BITS):
         colour = self.colour
+        check_info = self.get_check_info()
+
+        # Check evasions are already generated legal
+        if check_info.checkers:
+            move_list = self.get_check_evasions(colour, move_list, targets)
+            if gen_type == ALL or gen_type == EVASIONS:
+                return move_list
+
+            # Keep the evasions of the given gen_type, split in the same way as moves when not in check
+            count = 0
+            for move in move_list:
+                move_type = type_of[move]
+                if move_type == PROMOTION:
+                    is_capture = True if promotion_of[move] == QUEEN else False
+                else:
+                    is_capture = True if move_type == EN_PASSANT or (1 << dst_of[move]) & self.occupancy else False
+                if gen_type == CAPTURES:
+                    if not is_capture:
+                        continue
+                elif gen_type == QUIETS:
+                    if is_capture:
+                        continue
+                elif (move_type != NORMAL or (1 << dst_of[move]) & self.occupancy
+                        or not self.gives_check(move)):  # QUIET_CHECKS
+                    continue
+                move_list[count] = move
+                count += 1
+            del move_list[count:]
+
+            return move_list
+
+        if gen_type == EVASIONS:
+            gen_type = ALL
+
+        king_bb = self.piece_bb[(colour << 3) | KING]
+        king_sqr = bit_scan1(king_bb)
+        pinned = check_info.blockers[colour] & self.player_occ[colour]
+
+        # Only en passant moves, king moves and moves of pinned pieces can be illegal when not in check
+        # Illegal moves are removed by moving the legal moves down the list in place
+        move_list = self.get_pseudo_legal_moves(gen_type, move_list, targets)
+        count = 0
+        for move in move_list:
+            src_index = src_of[move]
+            src_bb = 1 << src_index
+            if type_of[move] == EN_PASSANT:
+                if not self.is_legal(move):
+                    continue
+            elif src_bb & pinned:
+                if not (1 << dst_of[move]) & bb_line[king_sqr][src_index]:
+                    continue
+            elif src_bb & king_bb:
+                # Castling legality is checked during move generation
+                # No slider attacks the king when not in check, so removing the king cannot uncover any attacks
+                if type_of[move] != CASTLING and self.is_square_attacked(dst_of[move]):
+                    continue
+            move_list[count] = move
+            count += 1
+        del move_list[count:]
 
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
+        return move_list
+
+    def is_pseudo_legal(self, move):
+        move_type = type_of[move]
+        colour = self.colour
+
+        src_index = src_of[move]
+        dst_index = dst_of[move]
         src_bb = 1 << src_index
         dst_bb = 1 << dst_index
 
@@ -603,9 +791,33 @@ class Position:
         if dst_bb & player_occ:
             return False
 
+        # Castling moves are only generated when the king can castle
+        if move_type == CASTLING:
+            castling_moves = []
+            self.generate_castling(colour, castling_moves)
+            return move in castling_moves
+
         occ = self.occupancy
         piece_type = self.squares[src_index] & 7
+        promotion_rank = RANK_8_BB if colour == WHITE else RANK_1_BB
+
+        if move_type == PROMOTION:
+            if piece_type != PAWN or not dst_bb & promotion_rank:
+                return False
+            if dst_bb & pawn_attacks[colour][src_index] & enemy_occ:  # Attack
+                return True
+            elif dst_bb & pawn_shift[colour](src_bb, NORTH) & ~occ:  # Push
+                return True
+            return False
+
+        if move_type == EN_PASSANT:
+            if piece_type != PAWN or dst_index != self.ep_square:
+                return False
+            return True if dst_bb & pawn_attacks[colour][src_index] else False
+
         if piece_type == PAWN:
+            if dst_bb & promotion_rank:  # Pawns reaching the last rank must promote
+                return False
             if dst_bb & pawn_attacks[colour][src_index] & enemy_occ:  # Attack
                 return True
             elif dst_bb & pawn_shift[colour](src_bb, NORTH) & ~occ:  # Single push
@@ -615,14 +827,13 @@ class Position:
                   and (pawn_shift[colour](src_bb, NORTH) & ~occ)):  # Double push
                 return True
         elif piece_type == BISHOP:
-            if dst_bb & batk_table[src_index][occ & bishop_masks[src_index]]:
+            if dst_bb & bishop_attacks(src_index, occ):
                 return True
         elif piece_type == ROOK:
-            if dst_bb & ratk_table[src_index][occ & rook_masks[src_index]]:
+            if dst_bb & rook_attacks(src_index, occ):
                 return True
         elif piece_type == QUEEN:
-            if dst_bb & (batk_table[src_index][occ & bishop_masks[src_index]]
-                         | ratk_table[src_index][occ & rook_masks[src_index]]):
+            if dst_bb & queen_attacks(src_index, occ):
                 return True
         elif dst_bb & pseudo_attacks[piece_type][src_index]:
             return True
@@ -632,49 +843,66 @@ class Position:
     # Tests the legality of a move, assuming it is pseudo-legal
     def is_legal(self, move):
         colour = self.colour
-        enemy_colour = colour ^ 1
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
+        src_index = src_of[move]
+        dst_index = dst_of[move]
         src_bb = 1 << src_index
         dst_bb = 1 << dst_index
-        move_type = move & (0x3 << 14)
+        move_type = type_of[move]
         king_sqr = bit_scan1(self.piece_bb[((colour << 3) | KING)])
-        occ = self.occupancy
-        enemy_rooks = self.piece_bb[((enemy_colour << 3) | ROOK)]
-        enemy_bishops = self.piece_bb[((enemy_colour << 3) | BISHOP)]
-        enemy_queens = self.piece_bb[((enemy_colour << 3) | QUEEN)]
 
-        if self.is_square_attacked(king_sqr):
-            return True if move in self.get_check_evasions(colour) else False
+        check_info = self.get_check_info()
+        checkers = check_info.checkers
 
         if move_type == EN_PASSANT:
-            self.make_move(move)
-            in_check = self.is_in_check(colour)
-            self.undo_move()
-            return False if in_check else True
-        
+            return self.is_legal_en_passant(move)
+
         if src_index == king_sqr:
-            # Castling legality is checked during move generation
+            # Castling legality is checked during move generation, and is never possible when in check
             if move_type == CASTLING:
-                return True
-            if self.is_square_attacked(dst_index, occ ^ (1 << king_sqr)):
+                return False if checkers else True
+            # The king only needs removing from the occupancy if a slider could be attacking it
+            if self.is_square_attacked(dst_index, self.occupancy ^ src_bb if checkers else None):
                 return False
             else:
                 return True
 
-        sliders = ((pseudo_attacks[ROOK][king_sqr] & (enemy_rooks | enemy_queens))
-                   | (pseudo_attacks[BISHOP][king_sqr] & (enemy_bishops | enemy_queens)))
+        if checkers:
+            # If in double check, only evasions are through king moves
+            if checkers & (checkers - 1):
+                return False
+            # Otherwise the checking piece must be captured or blocked
+            if not dst_bb & (checkers | bb_between[king_sqr][bit_scan1(checkers)]):
+                return False
+
+        # A pinned piece can only move along the line between the king and the pinning piece
+        if src_bb & check_info.blockers[colour]:
+            return True if dst_bb & bb_line[king_sqr][src_index] else False
+
+        return True
+
+    # Tests the legality of a pseudo-legal en passant capture, by looking for slider attacks
+    # on the king after both pawns are removed and the capturing pawn is placed on the target square
+    def is_legal_en_passant(self, move):
+        colour = self.colour
+        colour_mask = (colour ^ 1) << 3
+        src_index = src_of[move]
+        dst_index = dst_of[move]
+        ep_capture_bb = 1 << (dst_index - pawn_push[colour])
+        king_sqr = bit_scan1(self.piece_bb[(colour << 3) | KING])
+
+        # A check by a knight or a pawn other than the captured pawn cannot be evaded by en passant
+        if self.get_check_info().checkers & ~ep_capture_bb & (self.piece_bb[colour_mask | KNIGHT]
+                                                              | self.piece_bb[colour_mask | PAWN]):
+            return False
+
+        occ = (self.occupancy ^ (1 << src_index) ^ ep_capture_bb) | (1 << dst_index)
+        queens = self.piece_bb[colour_mask | QUEEN]
+
+        if rook_attacks(king_sqr, occ) & (self.piece_bb[colour_mask | ROOK] | queens):
+            return False
+        if bishop_attacks(king_sqr, occ) & (self.piece_bb[colour_mask | BISHOP] | queens):
+            return False
 
-        while sliders:
-            slider_sqr = bit_scan1(sliders)
-            sqrs_between = bb_between[king_sqr][slider_sqr]
-            blockers = sqrs_between & occ
-            if src_bb & sqrs_between:  # If moving blocker piece
-                if not blockers ^ src_bb:  # If no other blockers
-                    if not dst_bb & (sqrs_between | (1 << slider_sqr)):  # If not staying on the diagonal
-                        return False
-            sliders &= sliders - 1
-                
         return True
 
     def is_insufficient_material(self):
@@ -709,22 +937,19 @@ class Position:
             return True  
 
         # Checkmate/Stalemate
-        has_move = False
-        for move in self.get_pseudo_legal_moves():
-            if self.is_legal(move):
-                has_move = True
-                break
-        if not has_move:
+        if not self.get_legal_moves():
             return True
 
         # If none of the previous conditions are satisfied, the game is not over
         return False
 
     def is_square_attacked(self, sq, occ=None, colour=None):
-        if occ is None:
-            occ = self.occupancy
         if colour is None:
             colour = self.colour ^ 1
+        if occ is None:
+            if self.attack_info is not None:
+                return True if self.attack_info.attacked_by[colour][ALL_PIECES] & (1 << sq) else False
+            occ = self.occupancy
             
         colour_mask = colour << 3
         
@@ -739,11 +964,11 @@ class Position:
         queens = self.piece_bb[colour_mask | QUEEN]
         
         bishops = self.piece_bb[colour_mask | BISHOP]
-        if batk_table[sq][occ & bishop_masks[sq]] & (bishops | queens):
+        if bishop_attacks(sq, occ) & (bishops | queens):
             return True
         
         rooks = self.piece_bb[colour_mask | ROOK]
-        if ratk_table[sq][occ & rook_masks[sq]] & (rooks | queens):
+        if rook_attacks(sq, occ) & (rooks | queens):
             return True
         
         kings = self.piece_bb[colour_mask | KING]
@@ -757,11 +982,11 @@ class Position:
         if piece_type == PAWN:
             return pawn_attacks[colour][sq]
         if piece_type == BISHOP:
-            return batk_table[sq][occ & bishop_masks[sq]]
+            return bishop_attacks(sq, occ)
         elif piece_type == ROOK:
-            return ratk_table[sq][occ & rook_masks[sq]]
+            return rook_attacks(sq, occ)
         elif piece_type == QUEEN:
-            return batk_table[sq][occ & bishop_masks[sq]] | ratk_table[sq][occ & rook_masks[sq]]
+            return queen_attacks(sq, occ)
         else:
             return pseudo_attacks[piece_type][sq]
 
@@ -782,110 +1007,276 @@ class Position:
         attacked_by |= pawn_attacks[colour ^ 1][sq] & pawns
         attacked_by |= pseudo_attacks[KNIGHT][sq] & knights
         attacked_by |= pseudo_attacks[KING][sq] & kings
-        attacked_by |= ratk_table[sq][occ & rook_masks[sq]] & (rooks | queens)
-        attacked_by |= batk_table[sq][occ & bishop_masks[sq]] & (bishops | queens)
+        attacked_by |= rook_attacks(sq, occ) & (rooks | queens)
+        attacked_by |= bishop_attacks(sq, occ) & (bishops | queens)
 
         return attacked_by
 
     # Gets the bitboard of the squares attacked by a given piece of a certain colour
     def attacks_by(self, piece_type, colour):
-        if piece_type == ALL_PIECES:
-            piece_bb = self.player_occ[colour]
+        return self.get_attack_info().attacked_by[colour][piece_type]
+
+    # Gets the attacks of every piece on the board, computing them if not already known
+    def get_attack_info(self):
+        attack_info = self.attack_info
+        if attack_info is not None:
+            return attack_info
+
+        occ = self.occupancy
+        attacks = [0] * 64
+        attacked_by = [None, None]
+
+        for colour in COLOURS:
+            colour_mask = colour << 3
+
+            # Pawn attacks are shifted in bulk, as they are not needed for each square
+            pawns = self.piece_bb[colour_mask | PAWN]
+            if colour == WHITE:
+                pawn_attacked = (((pawns & ~A_FILE_BB) << 7) | ((pawns & ~H_FILE_BB) << 9)) & _64BITS
+            else:
+                pawn_attacked = ((pawns & ~A_FILE_BB) >> 9) | ((pawns & ~H_FILE_BB) >> 7)
+
+            knight_attacked = 0
+            knights = self.piece_bb[colour_mask | KNIGHT]
+            while knights:
+                sq = bit_scan1(knights)
+                attacks[sq] = pseudo_attacks[KNIGHT][sq]
+                knight_attacked |= attacks[sq]
+                knights &= knights - 1
+
+            bishop_attacked = 0
+            bishops = self.piece_bb[colour_mask | BISHOP]
+            while bishops:
+                sq = bit_scan1(bishops)
+                attacks[sq] = bishop_attacks(sq, occ)
+                bishop_attacked |= attacks[sq]
+                bishops &= bishops - 1
+
+            rook_attacked = 0
+            rooks = self.piece_bb[colour_mask | ROOK]
+            while rooks:
+                sq = bit_scan1(rooks)
+                attacks[sq] = rook_attacks(sq, occ)
+                rook_attacked |= attacks[sq]
+                rooks &= rooks - 1
+
+            queen_attacked = 0
+            queens = self.piece_bb[colour_mask | QUEEN]
+            while queens:
+                sq = bit_scan1(queens)
+                attacks[sq] = queen_attacks(sq, occ)
+                queen_attacked |= attacks[sq]
+                queens &= queens - 1
+
+            king_sqr = bit_scan1(self.piece_bb[colour_mask | KING])
+            attacks[king_sqr] = pseudo_attacks[KING][king_sqr]
+
+            attacked_by[colour] = [pawn_attacked | knight_attacked | bishop_attacked | rook_attacked
+                                   | queen_attacked | attacks[king_sqr],
+                                   pawn_attacked, knight_attacked, bishop_attacked, rook_attacked,
+                                   queen_attacked, attacks[king_sqr]]
+
+        attack_info = AttackInfo()
+        attack_info.attacks = attacks
+        attack_info.attacked_by = attacked_by
+
+        self.attack_info = attack_info
+        return attack_info
+
+    # Tests whether the static exchange evaluation of a move is at least the threshold,
+    # stopping as soon as the result is known. Pins are ignored
+    def see_ge(self, move, threshold=0):
+        move_type = type_of[move]
+        if move_type == CASTLING:
+            return True if threshold <= 0 else False
+
+        src_index = src_of[move]
+        dst_index = dst_of[move]
+        occ = self.occupancy ^ (1 << src_index) ^ (1 << dst_index)
+
+        # Value of the piece captured by the move, and of the piece left on the target square
+        if move_type == EN_PASSANT:
+            captured_value = MATERIAL[PAWN][MIDGAME]
+            occ ^= 1 << (dst_index - pawn_push[self.colour])
         else:
-            piece_bb = self.piece_bb[(colour << 3) | piece_type]
-            
-        attacked = 0
-        for sq in gen_bitboard_indices(piece_bb):
-            attacked |= self.attacks_from(sq, piece_type, colour, self.occupancy)
+            captured_value = MATERIAL[self.squares[dst_index] & 7][MIDGAME]
+        if move_type == PROMOTION:
+            piece_type = promotion_of[move]
+            captured_value += MATERIAL[piece_type][MIDGAME] - MATERIAL[PAWN][MIDGAME]
+        else:
+            piece_type = self.squares[src_index] & 7
 
-        return attacked
+        # Even if the piece is recaptured for free, the move still reaches the threshold
+        swap = captured_value - threshold
+        if swap < 0:
+            return False
+        swap = MATERIAL[piece_type][MIDGAME] - swap
+        if swap <= 0:
+            return True
 
-    # Gets the least valuable piece of a given colour from the provided bitboard
-    def get_least_valuable_piece(self, bb, colour):
-        colour_mask = colour << 3
+        # If the target is not defended, and moving the piece cannot uncover a defending slider,
+        # the piece cannot be recaptured
+        attack_info = self.attack_info
+        if attack_info is not None and move_type == NORMAL:
+            enemy_attacks = attack_info.attacked_by[self.colour ^ 1]
+            if (not enemy_attacks[ALL_PIECES] & (1 << dst_index)
+                    and not (enemy_attacks[BISHOP] | enemy_attacks[ROOK] | enemy_attacks[QUEEN]) & (1 << src_index)):
+                return True
 
-        pawns = bb & self.piece_bb[colour_mask | PAWN]
-        if pawns:
-            return pawns & -pawns  # LSB
+        piece_bb = self.piece_bb
+        queens = piece_bb[W_QUEEN] | piece_bb[B_QUEEN]
+        bishops = piece_bb[W_BISHOP] | piece_bb[B_BISHOP] | queens
+        rooks = piece_bb[W_ROOK] | piece_bb[B_ROOK] | queens
+        attackers = ((pawn_attacks[BLACK][dst_index] & piece_bb[W_PAWN])
+                     | (pawn_attacks[WHITE][dst_index] & piece_bb[B_PAWN])
+                     | (pseudo_attacks[KNIGHT][dst_index] & (piece_bb[W_KNIGHT] | piece_bb[B_KNIGHT]))
+                     | (pseudo_attacks[KING][dst_index] & (piece_bb[W_KING] | piece_bb[B_KING]))
+                     | (bishop_attacks(dst_index, occ) & bishops)
+                     | (rook_attacks(dst_index, occ) & rooks))
+
+        # Each side captures with its least valuable attacker in turn, and result is flipped after
+        # each capture. A side stops capturing once it can no longer do better than the threshold
+        colour = self.colour
+        result = 1
+        while True:
+            colour ^= 1
+            attackers &= occ
+            colour_attackers = attackers & self.player_occ[colour]
+            if not colour_attackers:
+                break
 
-        knights = bb & self.piece_bb[colour_mask | KNIGHT]
-        if knights:
-            return knights & -knights  # LSB
+            result ^= 1
 
-        bishops = bb & self.piece_bb[colour_mask | BISHOP]
-        if bishops:
-            return bishops & -bishops  # LSB
+            for piece_type in PIECE_TYPES[:KING - 1]:
+                bb = colour_attackers & piece_bb[(colour << 3) | piece_type]
+                if bb:
+                    break
+            else:
+                # The king can only capture if the other side has no attackers left
+                return bool(result ^ 1) if attackers & ~self.player_occ[colour] else bool(result)
 
-        rooks = bb & self.piece_bb[colour_mask | ROOK]
-        if rooks:
-            return rooks & -rooks  # LSB
+            swap = MATERIAL[piece_type][MIDGAME] - swap
+            if swap < result:
+                break
 
-        queens = bb & self.piece_bb[colour_mask | QUEEN]
-        if queens:
-            return queens & -queens  # LSB
+            # Remove the capturing piece, adding any sliders behind it
+            occ ^= bb & -bb
+            if piece_type == PAWN or piece_type == BISHOP or piece_type == QUEEN:
+                attackers |= bishop_attacks(dst_index, occ) & bishops
+            if piece_type == ROOK or piece_type == QUEEN:
+                attackers |= rook_attacks(dst_index, occ) & rooks
 
-        kings = bb & self.piece_bb[colour_mask | KING]
-        if kings:
-            return kings & -kings  # LSB
+        return bool(result)
 
-        return 0  # No pieces of given colour
+    # Gets the pieces of either colour which are the only blocker between
+    # the given square and a slider of the given colour
+    def slider_blockers(self, sq, slider_colour):
+        colour_mask = slider_colour << 3
+        queens = self.piece_bb[colour_mask | QUEEN]
+        sliders = ((pseudo_attacks[ROOK][sq] & (self.piece_bb[colour_mask | ROOK] | queens))
+                   | (pseudo_attacks[BISHOP][sq] & (self.piece_bb[colour_mask | BISHOP] | queens)))
+
+        blockers = 0
+        while sliders:
+            slider_sqr = bit_scan1(sliders)
+            sqrs_between = bb_between[sq][slider_sqr] & self.occupancy
+            if not sqrs_between & (sqrs_between - 1):
+                blockers |= sqrs_between
+            sliders &= sliders - 1
+
+        return blockers
+
+    # Gets the check information for the current position, computing it if not already known
+    def get_check_info(self):
+        check_info = self.check_info
+        if check_info is not None:
+            return check_info
 
-    def see(self, from_sq, target_sq):
-        gain = [None] * 32
-        depth = 0
-        gain[depth] = MATERIAL[self.squares[target_sq] & 7][MIDGAME]
-        occ = self.occupancy
         colour = self.colour
-        attackers = self.attacks_to(target_sq, colour ^ 1, occ)
-        attackers |= self.attacks_to(target_sq, colour, occ)
-        from_bb = 1 << from_sq
-        slider_blockers = occ ^ (self.piece_bb[W_KNIGHT] | self.piece_bb[B_KNIGHT]
-                                 | self.piece_bb[W_KING] | self.piece_bb[B_KING])
+        occ = self.occupancy
+        king_sqr = bit_scan1(self.piece_bb[(colour << 3) | KING])
+        enemy_king_sqr = bit_scan1(self.piece_bb[((colour ^ 1) << 3) | KING])
 
-        piece = self.squares[from_sq]
+        check_info = CheckInfo()
+        if self.attack_info is not None and not self.attack_info.attacked_by[colour ^ 1][ALL_PIECES] & (1 << king_sqr):
+            check_info.checkers = 0
+        else:
+            check_info.checkers = self.attacks_to(king_sqr, colour ^ 1, occ)
 
-        while from_bb:
-            depth += 1
-            colour ^= 1
-            gain[depth] = MATERIAL[piece & 7][MIDGAME] - gain[depth - 1]
-            if max(-gain[depth - 1], gain[depth]) < 0:
-                break
-            attackers ^= from_bb
-            occ ^= from_bb
-            if from_bb & slider_blockers:
-                attackers |= ratk_table[target_sq][occ & rook_masks[target_sq]] & (self.piece_bb[W_ROOK]
-                                                                                   | self.piece_bb[B_ROOK]
-                                                                                   | self.piece_bb[W_QUEEN]
-                                                                                   | self.piece_bb[B_QUEEN]) & occ
-                attackers |= batk_table[target_sq][occ & bishop_masks[target_sq]] & (self.piece_bb[W_BISHOP]
-                                                                                     | self.piece_bb[B_BISHOP]
-                                                                                     | self.piece_bb[W_QUEEN]
-                                                                                     | self.piece_bb[B_QUEEN]) & occ
-            from_bb = self.get_least_valuable_piece(attackers, colour)
-            if from_bb:
-                piece = self.squares[bit_scan1(from_bb)]
-
-        depth -= 1
-        while depth:
-            gain[depth - 1] = -max(-gain[depth - 1], gain[depth])
-            depth -= 1
-
-        return gain[0]
+        check_info.blockers = [0, 0]
+        check_info.blockers[colour] = self.slider_blockers(king_sqr, colour ^ 1)
+        check_info.blockers[colour ^ 1] = self.slider_blockers(enemy_king_sqr, colour)
+
+        bishop_checks = bishop_attacks(enemy_king_sqr, occ)
+        rook_checks = rook_attacks(enemy_king_sqr, occ)
+        check_info.check_squares = [0 for _ in range(7)]
+        check_info.check_squares[PAWN] = pawn_attacks[colour ^ 1][enemy_king_sqr]
+        check_info.check_squares[KNIGHT] = pseudo_attacks[KNIGHT][enemy_king_sqr]
+        check_info.check_squares[BISHOP] = bishop_checks
+        check_info.check_squares[ROOK] = rook_checks
+        check_info.check_squares[QUEEN] = bishop_checks | rook_checks
 
+        self.check_info = check_info
+        return check_info
+
+    # Tests whether a pseudo-legal move gives check, before it is made
     def gives_check(self, move):
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
-        piece = self.squares[src_index]
-        piece_type = piece & 7
-        piece_colour = piece >> 3
+        colour = self.colour
+        src_index = src_of[move]
+        dst_index = dst_of[move]
+        src_bb = 1 << src_index
+        dst_bb = 1 << dst_index
+        move_type = type_of[move]
+        piece_type = self.squares[src_index] & 7
+        enemy_king_bb = self.piece_bb[((colour ^ 1) << 3) | KING]
+        enemy_king_sqr = bit_scan1(enemy_king_bb)
 
-        attacks = self.attacks_from(dst_index, piece_type, piece_colour, self.occupancy)
-        
-        return attacks & self.piece_bb[((self.colour ^ 1) << 3) | KING]
+        check_info = self.get_check_info()
+
+        # Direct check
+        if move_type != PROMOTION and check_info.check_squares[piece_type] & dst_bb:
+            return True
+
+        # Discovered check
+        if src_bb & check_info.blockers[colour ^ 1] and not dst_bb & bb_line[enemy_king_sqr][src_index]:
+            return True
+
+        if move_type == NORMAL:
+            return False
+
+        if move_type == PROMOTION:
+            promoted_type = promotion_of[move]
+            attacks = self.attacks_from(dst_index, promoted_type, colour, self.occupancy ^ src_bb)
+            return True if attacks & enemy_king_bb else False
+
+        colour_mask = colour << 3
+        queens = self.piece_bb[colour_mask | QUEEN]
+        rooks = self.piece_bb[colour_mask | ROOK] | queens
+        bishops = self.piece_bb[colour_mask | BISHOP] | queens
+
+        if move_type == EN_PASSANT:
+            # The captured pawn may also have been blocking a slider
+            ep_capture_index = dst_index - pawn_push[colour]
+            occ = (self.occupancy ^ src_bb ^ (1 << ep_capture_index)) | dst_bb
+            if rook_attacks(enemy_king_sqr, occ) & rooks:
+                return True
+            if bishop_attacks(enemy_king_sqr, occ) & bishops:
+                return True
+            return False
+
+        # Castling gives check if the rook attacks the king from its destination square
+        if dst_index > src_index:  # Kingside
+            rook_src = (7 ^ (colour * 56))
+            rook_dst = dst_index - 1
+        else:  # Queenside
+            rook_src = (0 ^ (colour * 56))
+            rook_dst = dst_index + 1
+        occ = (self.occupancy ^ src_bb ^ (1 << rook_src)) | dst_bb | (1 << rook_dst)
+        return True if rook_attacks(rook_dst, occ) & enemy_king_bb else False
 
     def is_in_check(self, colour=None):
-        if colour is None:
-            colour = self.colour
+        if colour is None or colour == self.colour:
+            return True if self.get_check_info().checkers else False
         king_index = bit_scan1(self.piece_bb[((colour << 3) | KING)])
 
         if self.is_square_attacked(king_index, colour=colour^1):
@@ -895,108 +1286,88 @@ class Position:
 
     def is_checkmate(self):
         if self.is_in_check():
-            for move in self.get_pseudo_legal_moves():
-                if self.is_legal(move):
-                    return False
-            return True
+            return False if self.get_legal_moves() else True
         return False
 
-    def move_to_san(self, move):
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
-        
-        move_type = move & (0x3 << 14)
-        piece_type = self.squares[src_index] & 7
-
-        is_capture = True if self.squares[dst_index] or move_type == EN_PASSANT else False
-        is_promotion = True if move_type == PROMOTION else False
-        is_castle = True if move_type == CASTLING else False
-
-        if is_castle:
-            if dst_index > src_index:  # Kingside
-                return "0-0"
-            else:  # Queenside
-                return "0-0-0"
-
-        san = ""
-        if piece_type == PAWN:
-            if is_capture:
-                san += chr(97 + (src_index & 7))
-        else:
-            san += piece_int_to_string[piece_type]
-        if is_capture:
-            san += "x"
-        san += index_to_san[dst_index]
-
-        if is_promotion:
-            san += "="
-            san += piece_int_to_string[piece_type]
-        
-        if self.gives_check(move):
-            self.make_move(move)
-            if self.is_checkmate():
-                san += "#"
-            else:
-                san += "+"
-            self.undo_move()
-        return san
-
     def get_fen(self):
-        board = [None for _ in range(64)]
-
-        # Flip board vertically so that squares can be parsed in the correct order
-        for sq in range(32):
-            current_piece = self.squares[sq]
-            flipped_piece = self.squares[sq ^ 56]
-            board[sq] = flipped_piece
-            board[sq ^ 56] = current_piece
-
-        fen = ""
-        empty = 0
-
-        for sq in range(64):
-            piece = board[sq]
-            if piece:
-                if empty > 0:
-                    fen += str(empty)
-                    empty = 0
-                fen += piece_int_to_string[piece]
+        rows = []
+
+        # Squares are written from the a8 square, so ranks are visited from the top down
+        for rank_start in range(56, -8, -8):
+            row = []
+            empty = 0
+            for sq in range(rank_start, rank_start + 8):
+                piece = self.squares[sq]
+                if piece:
+                    if empty:
+                        row.append(str(empty))
+                        empty = 0
+                    row.append(piece_int_to_string[piece])
+                else:
+                    empty += 1
+            if empty:
+                row.append(str(empty))
+            rows.append(''.join(row))
+
+        castling = ''.join(char for char, castling_right in castling_string_to_int.items()
+                           if self.castling_rights & castling_right)
+
+        return ' '.join(('/'.join(rows),
+                         'w' if self.colour == WHITE else 'b',
+                         castling if castling else '-',
+                         index_to_san[self.ep_square] if self.ep_square is not None else '-',
+                         str(self.halfmove_clock),
+                         str(self.fullmove_number)))
+
+
+# Gets the starting 'FEN' string and moves of a game from the attributes of a position pickled before
+# games were stored that way, by taking back the moves on the square-centric board
+def game_from_old_state(state):
+    if 'undo_info' in state:
+        records = [(info['move'], info['captured'], info['en passant'], info['castling'], info['halfmove clock'])
+                   for info in state['undo_info']]
+    else:
+        # Null move records do not set the castling rights, which a null move leaves unchanged
+        records = [(undo.move, undo.captured, undo.ep_square, undo.castling_rights if undo.move else None,
+                    undo.halfmove_clock) for undo in state['undo_stack'][:state['ply']]]
+
+    position = Position.__new__(Position)
+    position.squares = [piece if piece else NO_PIECE for piece in state['squares']]
+    position.colour = state['colour']
+    position.ep_square = state['ep_square']
+    position.castling_rights = state['castling_rights']
+    position.halfmove_clock = state['halfmove_clock']
+    position.fullmove_number = state['fullmove_number']
+    squares = position.squares
+
+    for move, captured, ep_square, castling_rights, halfmove_clock in reversed(records):
+        position.colour ^= 1
+        position.ep_square = ep_square
+        position.halfmove_clock = halfmove_clock
+        if not move:
+            continue
+
+        position.castling_rights = castling_rights
+
+        src_index = src_of[move]
+        dst_index = dst_of[move]
+        move_type = type_of[move]
+        squares[src_index] = (position.colour << 3) | PAWN if move_type == PROMOTION else squares[dst_index]
+        squares[dst_index] = captured if captured else NO_PIECE
+        if move_type == EN_PASSANT:
+            squares[dst_index - pawn_push[position.colour]] = ((position.colour ^ 1) << 3) | PAWN
+        elif move_type == CASTLING:
+            # Kingside rooks move from the h file to the f file, and queenside rooks from the a file to the d file
+            if dst_index > src_index:
+                squares[src_index + 3] = squares[src_index + 1]
+                squares[src_index + 1] = NO_PIECE
             else:
-                empty += 1
-
-            if (sq + 1) % 8 == 0:
-                if empty > 0:
-                    fen += str(empty)
-                    empty = 0
-                if sq != 63:
-                    fen += "/"
+                squares[src_index - 4] = squares[src_index - 1]
+                squares[src_index - 1] = NO_PIECE
 
-        fen += " "
-
-        if self.colour == WHITE:
-            fen += "w"
-        else:
-            fen += "b"
-
-        fen += " "
-
-        if self.castling_rights:
-            if self.castling_rights & W_KINGSIDE:
-                fen += "W"
-            if self.castling_rights & W_QUEENSIDE:
-                fen += "Q"
-            if self.castling_rights & B_KINGSIDE:
-                fen += "k"
-            if self.castling_rights & B_QUEENSIDE:
-                fen += "q"
-        else:
-            fen += "-"
+    return position.get_fen(), [record[0] for record in records]
 
-        fen += " "
-        fen += str(self.ep_square) if self.ep_square else "-"
-        fen += " "
-        fen += str(self.halfmove_clock)
-        fen += " "
-        fen += str(self.fullmove_number)
 
-        return fen
+# Sets up a position for each 'FEN' string or EPD record in an iterable, such as the lines of a file, skipping blank lines
+def load_fens(fens):
+    return [Position(fen) for fen in fens if fen.strip()]
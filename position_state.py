@@ -0,0 +1,128 @@
+import struct
+from collections import namedtuple
+
+from gmpy2 import bit_scan1
+
+from common import bitboard_indices
+from consts import BLACK, PIECES, ZOBRIST_BOARD, ZOBRIST_CASTLING, ZOBRIST_COLOUR, ZOBRIST_ENPASSANT
+from position import Position
+
+# Fixed-size binary encoding of a position, 32 bytes long:
+#   occupancy bitboard (8 bytes, little-endian)
+#   piece of each occupied square in square order, 4 bits each (16 bytes)
+#   colour in bit 0, castling rights in bits 1-4 (1 byte)
+#   en passant square, or 64 if there is none (1 byte)
+#   halfmove clock (1 byte), fullmove number (2 bytes), padding (3 bytes)
+PACKED_STRUCT = struct.Struct('<Q16sBBBH3x')
+PACKED_SIZE = PACKED_STRUCT.size
+NO_EP_SQUARE = 64
+
+
+# Compact, immutable snapshot of a position, without any game history
+# The first twelve fields are the piece bitboards, in the same order as PIECES
+class PositionState(namedtuple('PositionState', 'w_pawn w_knight w_bishop w_rook w_queen w_king '
+                                                'b_pawn b_knight b_bishop b_rook b_queen b_king '
+                                                'colour castling_rights ep_square halfmove_clock '
+                                                'fullmove_number zobrist')):
+    __slots__ = ()
+
+    @classmethod
+    def from_position(cls, position):
+        piece_bb = position.piece_bb
+        return tuple.__new__(cls, (piece_bb[PIECES[0]], piece_bb[PIECES[1]], piece_bb[PIECES[2]],
+                                   piece_bb[PIECES[3]], piece_bb[PIECES[4]], piece_bb[PIECES[5]],
+                                   piece_bb[PIECES[6]], piece_bb[PIECES[7]], piece_bb[PIECES[8]],
+                                   piece_bb[PIECES[9]], piece_bb[PIECES[10]], piece_bb[PIECES[11]],
+                                   position.colour, position.castling_rights, position.ep_square,
+                                   position.halfmove_clock, position.fullmove_number, position.zobrist))
+
+    # Creates a new position with an empty game history
+    def to_position(self):
+        position = Position.__new__(Position)
+
+        position.piece_bb = [None for _ in range(15)]
+        for index, piece in enumerate(PIECES):
+            position.piece_bb[piece] = self[index]
+
+        position.colour = self.colour
+        position.castling_rights = self.castling_rights
+        position.ep_square = self.ep_square
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.undo_stack = []
+
+        position.init_from_bitboards()
+
+        return position
+
+    # Returns the state after making the given move, leaving this state unchanged
+    def make_move(self, move):
+        position = self.to_position()
+        position.make_move(move)
+        return PositionState.from_position(position)
+
+    # Pickle as a plain tuple of ints
+    def __reduce__(self):
+        return tuple.__new__, (PositionState, tuple(self))
+
+    def to_bytes(self):
+        squares = [0] * 64
+        occupancy = 0
+        for index, piece in enumerate(PIECES):
+            occupancy |= self[index]
+            for sq in bitboard_indices(self[index]):
+                squares[sq] = piece
+
+        packed_pieces = 0
+        shift = 0
+        for sq in bitboard_indices(occupancy):
+            packed_pieces |= squares[sq] << shift
+            shift += 4
+
+        return PACKED_STRUCT.pack(occupancy, packed_pieces.to_bytes(16, 'little'),
+                                  self.colour | (self.castling_rights << 1),
+                                  NO_EP_SQUARE if self.ep_square is None else self.ep_square,
+                                  self.halfmove_clock, self.fullmove_number)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls.from_packed(*PACKED_STRUCT.unpack(data))
+
+    # Creates a state from the fields of the binary encoding
+    # The zobrist key is computed the same way as for a position created from a FEN string
+    @classmethod
+    def from_packed(cls, occupancy, pieces, flags, ep_square, halfmove_clock, fullmove_number):
+        piece_bb = [0] * 15
+        zobrist = 0
+
+        packed_pieces = int.from_bytes(pieces, 'little')
+        while occupancy:
+            sq = bit_scan1(occupancy)
+            piece = packed_pieces & 0xF
+            piece_bb[piece] |= 1 << sq
+            zobrist ^= ZOBRIST_BOARD[piece][sq]
+            packed_pieces >>= 4
+            occupancy &= occupancy - 1
+
+        castling_rights = flags >> 1
+        zobrist ^= ZOBRIST_CASTLING[castling_rights]
+        if flags & 1 == BLACK:
+            zobrist ^= ZOBRIST_COLOUR
+        if ep_square != NO_EP_SQUARE:
+            zobrist ^= ZOBRIST_ENPASSANT[ep_square & 7]
+
+        return tuple.__new__(cls, (piece_bb[1], piece_bb[2], piece_bb[3], piece_bb[4], piece_bb[5], piece_bb[6],
+                                   piece_bb[9], piece_bb[10], piece_bb[11], piece_bb[12], piece_bb[13], piece_bb[14],
+                                   flags & 1, castling_rights, None if ep_square == NO_EP_SQUARE else ep_square,
+                                   halfmove_clock, fullmove_number, zobrist))
+
+
+# Encodes an iterable of states into one buffer of consecutive fixed-size records
+def encode_states(states):
+    return b''.join([state.to_bytes() for state in states])
+
+
+# Decodes a buffer of consecutive fixed-size records, such as bytes or a memoryview
+def decode_states(buffer):
+    from_packed = PositionState.from_packed
+    return [from_packed(*fields) for fields in PACKED_STRUCT.iter_unpack(buffer)]
@@ -1,11 +1,10 @@
-import copy
-
 from PyQt5.QtCore import pyqtSignal, QPropertyAnimation, QEventLoop, QRegExp, Qt, QThread
 from PyQt5.QtGui import QIcon, QPixmap
 from PyQt5.QtWidgets import QApplication, QFrame, QGridLayout, QLabel, QMessageBox, QSizePolicy, QWidget
 
 import common
 from consts import CASTLING, PROMOTION, KNIGHT_PROMOTION, BISHOP_PROMOTION, ROOK_PROMOTION, QUEEN_PROMOTION
+from moves import src_of, dst_of, type_of
 from position import Position
 from search import Search
 
@@ -112,7 +111,6 @@ class ChessBoard(QFrame):
         self.set_fen(common.starting_fen)
         self.refresh_from_state()
 
-        self.position.undo_info.clear()
         self.undone_stack.clear()
 
     def suggest_move(self):
@@ -127,8 +125,8 @@ class ChessBoard(QFrame):
             move = self.search.iter_search(time_limit=1)
             self.position = self.search.position
 
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
+        src_index = src_of[move]
+        dst_index = dst_of[move]
 
         piece = self.piece_at_square(src_index)
         self.piece_glide(piece, dst_index)
@@ -170,11 +168,8 @@ class ChessBoard(QFrame):
             self.unhighlight(sqr_index)
 
     def moves_from_square(self, sqr_index):
-        moves = self.position.get_pseudo_legal_moves()
-        moves = [x for x in moves if (x >> 6) & 0x3F == sqr_index]
-
-        # Filter out illegal moves
-        moves = list(filter(self.position.is_legal, moves))
+        moves = self.position.get_legal_moves()
+        moves = [x for x in moves if src_of[x] == sqr_index]
 
         return moves
 
@@ -221,8 +216,8 @@ class ChessBoard(QFrame):
             self.piece_glide(rook, rook_dst)
 
     def move_glide(self, move, is_undo):
-        src_index = (move >> 6) & 0x3F
-        dst_index = move & 0x3F
+        src_index = src_of[move]
+        dst_index = dst_of[move]
 
         if not is_undo:
             piece = self.piece_at_square(src_index)
@@ -231,7 +226,7 @@ class ChessBoard(QFrame):
 
         self.piece_glide(piece, src_index if is_undo else dst_index)
 
-        if move & (0x3 << 14) == CASTLING:
+        if type_of[move] == CASTLING:
             self.do_rook_castle(dst_index, is_undo)
 
     def player_move(self, move):
@@ -244,10 +239,6 @@ class ChessBoard(QFrame):
         # After a move has been made, the player can no longer redo moves that were undone previously
         self.undone_stack.clear()
 
-        # If player is black, increment fullmove number after player's turn
-        if not self.user_is_white:
-            self.position.fullmove_number += 1
-
         self.parent.info.move_frame.update_moves()
 
         if self.position.is_game_over():
@@ -262,10 +253,6 @@ class ChessBoard(QFrame):
         self.position.make_move(move)
         self.refresh_from_state()
 
-        # If computer is black, increment fullmove number after computer's turn
-        if self.user_is_white:
-            self.position.fullmove_number += 1
-
         self.parent.info.move_frame.update_moves()
 
         if self.position.is_game_over():
@@ -286,10 +273,7 @@ class ChessBoard(QFrame):
     def game_over(self):
         user = self.parent.parent.user
 
-        legal_moves = list(filter(self.position.is_legal,
-                                  self.position.get_pseudo_legal_moves()))
-
-        if not legal_moves:
+        if not self.position.get_legal_moves():
             # Checkmate
             if self.position.is_in_check():
                 text = "{} wins by checkmate".format("White" if self.position.colour else "Black")
@@ -326,7 +310,7 @@ class ChessBoard(QFrame):
         self.saved = True
 
     def save(self):
-        self.parent.parent.user.saved_game = copy.deepcopy(self.position)
+        self.parent.parent.user.saved_game = self.position.get_game()
         self.saved = True
 
 
@@ -440,7 +424,7 @@ class PieceLabel(QLabel):
                     self.legal_moves = self.board.moves_from_square(sqr_index)
 
                     # Only need destination square for each move
-                    self.legal_dst_squares = list(map(lambda move: common.index_to_san[move & 0x3F], self.legal_moves))
+                    self.legal_dst_squares = list(map(lambda move: common.index_to_san[dst_of[move]], self.legal_moves))
 
                     # Highlight origin and destination squares
                     self.board.highlight(sqr_index)
@@ -517,7 +501,7 @@ class PieceLabel(QLabel):
                         if move & 0xFFF == from_to:
                             move_made = move
 
-                    move_type = move_made & (0x3 << 14)
+                    move_type = type_of[move_made]
 
                     if move_type == PROMOTION:
                         promotion_prompt = QMessageBox()
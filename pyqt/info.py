@@ -3,6 +3,7 @@ from PyQt5.QtGui import QFont, QPixmap
 from PyQt5.QtWidgets import QFrame, QGridLayout, QHBoxLayout, QLabel, QScrollArea, QSizePolicy, QVBoxLayout, QWidget
 
 import common
+from moves import move_to_san
 from pyqt.custom_widgets import SquareButton, SquareLabel
 from position import Position
 
@@ -97,7 +98,7 @@ class MoveFrame(QScrollArea):
         font = QFont()
         font.setBold(True)
 
-        move_history = list(x['move'] for x in self.board.position.undo_info)
+        move_history = self.board.position.move_history()
         undone_moves = list(reversed(self.board.undone_stack))
         current_move_index = len(move_history) - 1
         
@@ -116,7 +117,7 @@ class MoveFrame(QScrollArea):
                 column_num = 2
 
             # Convert move to SAN and add to frame
-            san_move = temp_pos.move_to_san(move)
+            san_move = move_to_san(temp_pos, move)
             move_label = QLabel(san_move)
             move_label.setStyleSheet('color: black')
             move_label.setFont(font)
@@ -192,11 +193,11 @@ class ButtonFrame(QFrame):
             self.enable_buttons()
 
     def undo_move(self):
-        if self.board.position.undo_info:
+        if self.board.position.ply:
             self.disable_buttons()
 
             # Undo computer's move
-            move = self.board.position.undo_info[-1]['move']  # Get move at the top of move stack
+            move = self.board.position.last_move()  # Get move at the top of move stack
             self.board.move_glide(move, True)  # Move piece back to source square
             self.board.position.undo_move()  # Undo move in game state
             self.board.refresh_from_state()  # Refresh board
@@ -205,8 +206,8 @@ class ButtonFrame(QFrame):
             self.parent.move_frame.update_moves()
 
             # Undo player's move
-            if self.board.position.undo_info:
-                move = self.board.position.undo_info[-1]['move'] # Get move at the top of move stack
+            if self.board.position.ply:
+                move = self.board.position.last_move()  # Get move at the top of move stack
                 self.board.move_glide(move, True)  # Move piece back to source square
                 self.board.position.undo_move()  # Undo move in game state
                 self.board.refresh_from_state()  # Refresh board
@@ -217,8 +218,6 @@ class ButtonFrame(QFrame):
                 self.board.undone_stack.clear()
                 self.board.search_thread.start()
 
-            self.board.position.fullmove_number -= 1
-
             self.enable_buttons()
 
     def redo_move(self):
@@ -239,8 +238,6 @@ class ButtonFrame(QFrame):
 
             self.parent.move_frame.update_moves()
 
-            self.board.position.fullmove_number += 1
-
             self.enable_buttons()
 
 
@@ -1,10 +1,9 @@
-import copy
-
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont, QIcon
 from PyQt5.QtWidgets import QCheckBox, QDialog, QFrame, QHBoxLayout, QSlider, QStackedWidget, QVBoxLayout, QWidget
 
 import common
+from position import Position
 from pyqt.custom_widgets import MenuButton, MenuImage, MenuLabel
 
 
@@ -182,7 +181,7 @@ class MenuFrame(QFrame):
         self.parent.stack.setCurrentIndex(1)
 
     def load_game(self, colour, difficulty, autosave, self_play):
-        self.parent.game_frame.board.set_position(copy.deepcopy(self.parent.user.saved_game))
+        self.parent.game_frame.board.set_position(Position(*self.parent.user.saved_game))
         self.parent.game_frame.board.saved = True
         self.parent.game_frame.info.move_frame.update_moves()
         self.parent.game_frame.board.user_is_white = True if colour == 'w' else False
@@ -1,12 +1,13 @@
-import copy
 import math
 import time
 
 from evaluate import Evaluate
+from moves import src_of, dst_of, type_of, promotion_of, move_to_san
 
 from consts import (TTEntry, MIDGAME, INFINITY, CAPTURES, MATERIAL, LOWER, UPPER,
-                    EXACT, PAWN, KING, PROMOTION, CASTLING, DRAW, MATE, ALL, QUIETS,
-                    EVASIONS)
+                    EXACT, PROMOTION, CASTLING, DRAW, MATE, ALL, QUIETS,
+                    EVASIONS, QUIET_CHECKS, MAX_PLY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN,
+                    RANK_1_BB, RANK_8_BB, DELTA_MARGIN, _64BITS)
 
 
 class SearchStoppedException(Exception):
@@ -38,31 +39,53 @@ class Search:
 
         self.eval = Evaluate()
 
-    def search_moves(self, gen_type, hash_move=None, killers=None):
+        # Reusable move lists, indexed by ply
+        self.move_lists = [[] for _ in range(MAX_PLY)]
+
+    # Moves are generated into the move list for the given ply. To order them, each move is
+    # replaced in place by its sort key, with the move kept in the lowest 16 bits and its
+    # index above that, so that moves with equal scores stay in generation order
+    # In quiescence search, QUIET_CHECKS searches the captures followed by the quiet checks, and the
+    # captures can be restricted to the target squares given
+    def search_moves(self, ply, gen_type, hash_move=None, killers=None, targets=_64BITS):
+        while len(self.move_lists) <= ply:
+            self.move_lists.append([])
+        move_list = self.move_lists[ply]
+
         # Search hash move first
         if hash_move and self.position.is_pseudo_legal(hash_move) and self.position.is_legal(hash_move):
             yield hash_move
 
         # Use specialised check evasion generator
         if gen_type == EVASIONS:
-            evasions = self.position.get_check_evasions(self.position.colour)
-            for move in evasions:
+            self.position.get_check_evasions(self.position.colour, move_list)
+            for move in move_list:
                 yield move
 
         # Search captures before quiet moves
-        if gen_type == CAPTURES or gen_type == ALL:
-            captures = self.position.get_pseudo_legal_moves(CAPTURES)
-
-            # Order captures by MVV/LVA
-            captures = sorted(captures, key=lambda x: (-(MATERIAL[((x >> 12) & 0x3) + 2][MIDGAME]
-                                                         + MATERIAL[self.position.squares[x & 0x3F] & 7][MIDGAME])
-                                                       if x & (0x3 << 14) == PROMOTION else
-                                                       -MATERIAL[self.position.squares[x & 0x3F] & 7][MIDGAME],
-                                                       MATERIAL[self.position.squares[(x >> 6) & 0x3F] & 7][MIDGAME]))
-            # Return legal captures
-            for move in captures:
-                if self.position.is_legal(move):
-                    yield move
+        if gen_type == CAPTURES or gen_type == QUIET_CHECKS or gen_type == ALL:
+            self.position.get_legal_moves(CAPTURES, move_list, targets)
+
+            # Order captures by MVV/LVA, with captures losing material by SEE searched last.
+            # In quiescence search, captures losing material are not searched at all
+            squares = self.position.squares
+            count = 0
+            for index, move in enumerate(move_list):
+                losing = 0 if self.position.see_ge(move) else 1
+                if losing and gen_type != ALL:
+                    continue
+                victim_value = MATERIAL[squares[dst_of[move]] & 7][MIDGAME]
+                if type_of[move] == PROMOTION:
+                    victim_value += MATERIAL[promotion_of[move]][MIDGAME]
+                attacker_value = MATERIAL[squares[src_of[move]] & 7][MIDGAME]
+                move_list[count] = (((((((losing << 14) - victim_value) << 15) + attacker_value) << 8) + index) << 16
+                                    | move)
+                count += 1
+            del move_list[count:]
+            move_list.sort()
+
+            for move in move_list:
+                yield move & 0xFFFF
 
         # Search killer moves next
         if killers:
@@ -76,17 +99,25 @@ class Search:
                     if killer2 != hash_move and self.position.is_pseudo_legal(killer2) and self.position.is_legal(killer2):
                         yield killer2
 
+        # Search quiet checks not losing material by SEE after the captures
+        if gen_type == QUIET_CHECKS:
+            self.position.get_legal_moves(QUIET_CHECKS, move_list)
+            for move in move_list:
+                if self.position.see_ge(move):
+                    yield move
+
         # Search quiet moves last
         if gen_type == QUIETS or gen_type == ALL:
-            quiets = self.position.get_pseudo_legal_moves(QUIETS)
+            self.position.get_legal_moves(QUIETS, move_list)
 
             # Order quiet moves by history heuristic
-            quiets = sorted(quiets, key=lambda x: -self.history[self.position.colour][(x >> 6) & 0x3F][x & 0x3F])
+            history = self.history[self.position.colour]
+            for index, move in enumerate(move_list):
+                move_list[index] = (((-history[src_of[move]][dst_of[move]] << 8) + index) << 16) | move
+            move_list.sort()
 
-            # Return legal quiet moves
-            for move in quiets:
-                if self.position.is_legal(move):
-                    yield move
+            for move in move_list:
+                yield move & 0xFFFF
     
     def tt_store(self, index, zobrist, move, depth, score, type_):
         self.tt[index] = TTEntry(zobrist, move, depth, score, type_)
@@ -143,17 +174,12 @@ class Search:
                 raise SearchStoppedException
         
         # Endgame is defined as positions with only kings or pawns for the side to move
-        if (self.position.player_occ[self.position.colour]
-                & ~self.position.piece_bb[(self.position.colour << 3) | KING]
-                & ~self.position.piece_bb[(self.position.colour << 3) | PAWN]):
-            is_endgame = False
-        else:
-            is_endgame = True
+        is_endgame = False if self.position.non_pawn_material[self.position.colour] else True
 
         in_check = True if self.position.is_in_check() else False
 
         # Null move pruning
-        if not in_check and not is_endgame and not is_pv_node and self.position.undo_info[-1]['move']:
+        if not in_check and not is_endgame and not is_pv_node and self.position.last_move():
             depth_reduction = 2
             self.position.make_null_move()
             null_score = -self.pvs(-beta, -beta + 1, depth - depth_reduction - 1, ply + 1)
@@ -169,14 +195,14 @@ class Search:
         move_count = 0
 
         if in_check:
-            moves = self.search_moves(EVASIONS, hash_move)
+            moves = self.search_moves(ply, EVASIONS, hash_move)
         else:
-            moves = self.search_moves(ALL, hash_move, self.killers[ply][:])
+            moves = self.search_moves(ply, ALL, hash_move, self.killers[ply][:])
 
         for move in moves:
             move_count += 1
 
-            is_capture = True if (1 << (move & 0x3F)) & self.position.occupancy else False
+            is_capture = True if (1 << dst_of[move]) & self.position.occupancy else False
 
             self.position.make_move(move)
 
@@ -186,8 +212,8 @@ class Search:
             else:
                 # Late move reductions
                 if (move_count > 3 and not in_check and not is_capture and not is_endgame
-                        and not self.position.gives_check(move) and move & (0x3 << 14) != PROMOTION
-                        and move & (0x3 << 14) != CASTLING):
+                        and not self.position.is_in_check() and type_of[move] != PROMOTION
+                        and type_of[move] != CASTLING):
                     depth_reduction = 1
                     score = -self.pvs(-alpha - 1, -alpha, depth - depth_reduction - 1, ply + 1)
                 else:
@@ -205,13 +231,13 @@ class Search:
             if score > best_score:
                 if score > alpha:
                     if score >= beta:
-                        if not is_capture and move & (0x3 << 14) != PROMOTION:
+                        if not is_capture and type_of[move] != PROMOTION:
                             # Store killer move
                             if move != self.killers[ply][0]:
                                 self.killers[ply][1] = self.killers[ply][0]
                                 self.killers[ply][0] = move
                             # Increase score of move in history table
-                            self.history[self.position.colour][(move >> 6) & 0x3F][move & 0x3F] += depth * depth
+                            self.history[self.position.colour][src_of[move]][dst_of[move]] += depth * depth
                         self.tt_store(tt_index, self.position.zobrist, move, depth, score, LOWER)
                         return score
                     alpha = score
@@ -239,11 +265,10 @@ class Search:
             return DRAW
 
         if self.position.is_in_check():
-            moves = self.search_moves(EVASIONS)
+            moves = self.search_moves(ply, EVASIONS)
             best_score = -INFINITY
             in_check = True
         else:
-            moves = self.search_moves(CAPTURES)
             in_check = False
 
             # Static evaluation
@@ -254,15 +279,24 @@ class Search:
                 alpha = static_eval
             best_score = static_eval
 
+            # Delta pruning: if capturing a pawn cannot raise the score to alpha, captures are only generated
+            # to the squares of pieces which can, and to the last ranks for promotions
+            targets = _64BITS
+            if static_eval + MATERIAL[PAWN][MIDGAME] + DELTA_MARGIN <= alpha:
+                targets = RANK_1_BB | RANK_8_BB
+                for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN):
+                    if static_eval + MATERIAL[piece_type][MIDGAME] + DELTA_MARGIN > alpha:
+                        targets |= self.position.piece_bb[((self.position.colour ^ 1) << 3) | piece_type]
+
+            # Captures losing material by SEE are pruned by the move ordering
+            # Quiet checks are also searched at the first ply of the quiescence search
+            moves = self.search_moves(ply, QUIET_CHECKS if depth >= 0 else CAPTURES, targets=targets)
+
         move_count = 0
 
         for move in moves:
             move_count += 1
 
-            # SEE pruning when not in check
-            if not in_check and self.position.see((move >> 6) & 0x3F, move & 0x3F) < 0:
-                continue
-
             self.position.make_move(move)
             if move_count == 1:
                 score = -self.quiescence(-beta, -alpha, depth - 1, ply + 1)
@@ -285,11 +319,13 @@ class Search:
         return best_score
             
     # Wrap search algorithm in iterative deepening structure
-    def iter_search(self, max_depth=math.inf, time_limit=math.inf):
+    # The search result is printed unless verbose is false
+    def iter_search(self, max_depth=math.inf, time_limit=math.inf, verbose=True):
         self.node_count = 0
         self.start_time = time.time()
         self.time_limit = time_limit
         depth = 0
+        root_ply = self.position.ply
 
         # Clear killer moves
         for ply in self.killers:
@@ -299,11 +335,15 @@ class Search:
         while depth < max_depth and time.time() - self.start_time < self.time_limit:
             depth += 1
 
-            current_pos = copy.deepcopy(self.position)
             try:
                 self.pvs(-INFINITY, INFINITY, depth)
             except SearchStoppedException: # Time expired
-                self.position = current_pos
+                # Undo the moves made by the interrupted search
+                while self.position.ply > root_ply:
+                    if self.position.last_move():
+                        self.position.undo_move()
+                    else:
+                        self.position.undo_null_move()
                 break
 
             # Retrieve best move from transposition table
@@ -318,37 +358,13 @@ class Search:
             else:
                 raise Exception("No transposition table entry for current position")
 
-        print("{} found move {} with depth {}, score of {}".format("Black" if self.position.colour else "White",
-                                                                   self.position.move_to_san(tt_move),
-                                                                   tt_depth, tt_score))
-        print("Searched {} nodes".format(self.node_count))
-        print("Time taken: {:0.2f}s".format(time.time() - self.start_time))
-        print()
+        if verbose:
+            print("{} found move {} with depth {}, score of {}".format("Black" if self.position.colour else "White",
+                                                                       move_to_san(self.position, tt_move),
+                                                                       tt_depth, tt_score))
+            print("Searched {} nodes".format(self.node_count))
+            print("Time taken: {:0.2f}s".format(time.time() - self.start_time))
+            print()
 
         return tt_move
 
-    # Perft function used for debugging
-    def perft(self, depth):
-        node_count = 0
-
-        if depth == 0:
-            return 1
-
-        if self.position.is_in_check():
-            in_check = True
-            moves = self.position.get_check_evasions(self.position.colour)
-        else:
-            in_check = False
-            moves = self.position.get_pseudo_legal_moves()
-
-        for move in moves:
-            if not in_check:
-                if not self.position.is_legal(move):
-                    continue
-
-            self.position.make_move(move)
-            child_nodes = self.perft(depth - 1)
-            node_count += child_nodes
-            self.position.undo_move()
-
-        return node_count
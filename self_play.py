@@ -60,7 +60,7 @@ def game_over(position, a_is_white):
 
     print()
     
-    if not list(filter(position.is_legal, position.get_pseudo_legal_moves())):
+    if not position.get_legal_moves():
         # Checkmate
         if position.is_in_check():
             if position.colour:
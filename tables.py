@@ -0,0 +1,33 @@
+import sys
+
+
+# Registry of lookup tables which are built the first time they are accessed
+# A module registers the function building each of its tables, and forwards unknown attribute lookups
+# to the registry from its module-level __getattr__. Built tables are stored on the module, so later
+# accesses are plain attribute lookups
+class TableRegistry:
+    def __init__(self, module_name):
+        self.module = sys.modules[module_name]
+        self.builders = {}
+
+    # Decorator registering a function which builds one or more tables, returned in the same order as the names
+    def register(self, *names):
+        def decorator(builder):
+            for name in names:
+                self.builders[name] = (builder, names)
+            return builder
+        return decorator
+
+    # Builds the table with the given name, along with any other tables from the same function
+    def build(self, name):
+        if name not in self.builders:
+            raise AttributeError("module '{}' has no attribute '{}'".format(self.module.__name__, name))
+
+        builder, names = self.builders[name]
+        tables = builder()
+        if len(names) == 1:
+            tables = (tables,)
+        for table_name, table in zip(names, tables):
+            setattr(self.module, table_name, table)
+
+        return getattr(self.module, name)
@@ -12,8 +12,16 @@ class User:
 
         self.history = [0]
 
+        # Saved game as the starting 'FEN' string and the list of moves made from it
         self.saved_game = None
 
+    # Games saved as positions, before they were saved as a 'FEN' string and moves, are converted when loaded
+    # The class is checked by name, so that this module does not import the engine
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if type(self.saved_game).__name__ == 'Position':
+            self.saved_game = self.saved_game.get_game()
+
     def add_win(self):
         self.wins += 1
         total = self.wins + self.losses + self.draws